@@ -0,0 +1,3 @@
+from .features import features, orders
+from .parallel import ReportEngine
+from .reports import average_basket, hourly_volume, monthly_volume, top_products, volume, weekday_volume
\ No newline at end of file
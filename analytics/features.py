@@ -0,0 +1,96 @@
+import pandas as pd
+
+from config import DATA_PATH
+
+# промежуточные кадры по версии набора данных: {(источник, версия, имя): кадр}
+_frames = {}
+# версий одного источника хранится не больше одной: новая версия вытесняет старые кадры
+_versions = {}
+
+
+def source_key(source) -> tuple:
+    # (ключ источника, версия); источник - путь к очищенному csv или DBRepo
+    if isinstance(source, str):
+        from raw_data import cache
+        return ('csv', source), cache.version(source)
+    return ('db', source.con.databaseName()), source.sales_version()
+
+
+def memoized(source, name: str, build):
+    # кадр name для источника; build(source) вызывается только при новой версии данных.
+    # Если версию узнать нельзя (None), результат не запоминается
+    key, version = source_key(source)
+    if version is None:
+        return build(source)
+    if _versions.get(key) != version:
+        for cached in [cached for cached in _frames if cached[0] == key]:
+            del _frames[cached]
+        _versions[key] = version
+    if (key, name) not in _frames:
+        _frames[(key, name)] = build(source)
+    return _frames[(key, name)]
+
+
+def clear() -> None:
+    _frames.clear()
+    _versions.clear()
+
+
+def load_sales(source=DATA_PATH) -> pd.DataFrame:
+    # строки продаж: date, time, order_ID, product, quantity, unit_price (и bakery_id для базы)
+    if isinstance(source, str):
+        from raw_data import DF
+        return DF(source).data
+    data = pd.DataFrame(source.get_sale_lines())
+    data['product'] = data['product'].astype('category')
+    data['unit_price'] = data['unit_price'].astype(float)
+    return data
+
+
+def parse_column(values: pd.Series, fmt: str) -> pd.Series:
+    # дат и времён намного меньше, чем строк: разбираем каждое уникальное значение один раз
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(uniques, format=fmt)
+    return pd.Series(parsed.take(codes), index=values.index)
+
+
+def build_features(source) -> pd.DataFrame:
+    data = load_sales(source)
+    date = parse_column(data['date'], '%Y-%m-%d')
+    clock = parse_column(data['time'], '%H:%M')
+    if 'bakery_id' not in data:
+        # в csv продажи одной пекарни
+        data = data.assign(bakery_id=1)
+    return data.assign(
+        date_time=date + (clock - clock.dt.normalize()),
+        hour=clock.dt.hour.astype('int8'),
+        weekday=date.dt.weekday.astype('int8'),
+        month=date.dt.to_period('M'),
+        # float32 -> округлённый float64, как в order_columns
+        revenue=data['quantity'] * data['unit_price'].astype(float).round(2),
+    )
+
+
+def features(source=DATA_PATH) -> pd.DataFrame:
+    # строки продаж с bakery_id и признаками date_time, hour, weekday (0 - понедельник), month (период год-месяц) и revenue
+    return memoized(source, 'features', build_features)
+
+
+def build_orders(source) -> pd.DataFrame:
+    data = features(source)
+    # номера заказов в файлах пекарен независимы, заказ определяется парой (пекарня, номер)
+    grouped = data.groupby(['bakery_id', 'order_ID'], sort=False)
+    return pd.DataFrame({
+        'date_time': grouped['date_time'].first(),
+        'hour': grouped['hour'].first(),
+        'weekday': grouped['weekday'].first(),
+        'month': grouped['month'].first(),
+        'lines': grouped.size(),
+        'quantity': grouped['quantity'].sum(),
+        'revenue': grouped['revenue'].sum(),
+    })
+
+
+def orders(source=DATA_PATH) -> pd.DataFrame:
+    # один ряд на заказ с индексом (bakery_id, order_ID): время, число строк, количество и сумма
+    return memoized(source, 'orders', build_orders)
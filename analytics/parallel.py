@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_PATH
+
+from .features import features, source_key
+
+GROUPS = ('bakery_id', 'month', 'hour', 'weekday')
+PARTITIONS = ('month', 'bakery_id')
+
+
+def write_columns(data: pd.DataFrame, directory: str, partition: str) -> tuple:
+    # столбцы, отсортированные по ключу разбиения, пишутся в .npy; процессы открывают их через
+    # memory map и читают только свой диапазон строк. Возвращает (границы частей, названия продуктов)
+    data = data.sort_values([partition, 'bakery_id', 'order_ID'], kind='stable')
+    product = data['product'].astype(str).astype('category')
+    columns = {
+        'bakery_id': data['bakery_id'].to_numpy(dtype=np.int32),
+        # месяц - порядковый номер периода, обратно в Period переводит merge
+        'month': data['month'].array.asi8.astype(np.int32),
+        'hour': data['hour'].to_numpy(dtype=np.int32),
+        'weekday': data['weekday'].to_numpy(dtype=np.int32),
+        'order_ID': data['order_ID'].to_numpy(dtype=np.int64),
+        'product': product.cat.codes.to_numpy(dtype=np.int32),
+        'quantity': data['quantity'].to_numpy(dtype=np.int64),
+        'revenue': data['revenue'].to_numpy(dtype=np.float64),
+    }
+    for name, values in columns.items():
+        np.save(os.path.join(directory, name + '.npy'), values)
+    key = columns[partition]
+    bounds = np.flatnonzero(np.r_[True, key[1:] != key[:-1], True]) if len(key) else np.array([0])
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist())), list(product.cat.categories)
+
+
+def partial(task: tuple) -> dict:
+    # частичные суммы по одной части строк [start, stop); выполняется в процессе пула.
+    # Заказ целиком лежит в одной части (месяц и пекарня у заказа одни), поэтому суммы частей просто складываются
+    directory, start, stop, by, products = task
+    column = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')[start:stop]
+    groups, group = np.unique(column(by), return_inverse=True)
+    # заказ - пара (пекарня, номер): номера в файлах разных пекарен совпадают
+    bakery_id = column('bakery_id')
+    order_id = column('order_ID')
+    first = np.flatnonzero(np.r_[True, (order_id[1:] != order_id[:-1]) | (bakery_id[1:] != bakery_id[:-1])])
+    quantity = column('quantity')
+    revenue = column('revenue')
+    size = len(groups)
+    result = {
+        'groups': groups,
+        'lines': np.bincount(group, minlength=size),
+        'orders': np.bincount(group[first], minlength=size),
+        'quantity': np.bincount(group, weights=quantity, minlength=size),
+        'revenue': np.bincount(group, weights=revenue, minlength=size),
+    }
+    if products:
+        keys = group.astype(np.int64) * products + column('product')
+        result['product_quantity'] = np.bincount(keys, weights=quantity, minlength=size * products).reshape(size, products)
+        result['product_revenue'] = np.bincount(keys, weights=revenue, minlength=size * products).reshape(size, products)
+    return result
+
+
+class ReportEngine:
+    # отчёты по всей истории сети на нескольких ядрах: данные делятся на части по месяцу или пекарне,
+    # каждая часть считается в отдельном процессе, частичные суммы складываются здесь
+    def __init__(self, source=DATA_PATH, partition: str='month', workers: int=None) -> None:
+        if partition not in PARTITIONS:
+            raise ValueError(f'Unknown partition: {partition}')
+        self.source = source
+        self.partition = partition
+        self.workers = workers or os.cpu_count()
+        # spawn, а не fork: в GUI процесс держит потоки Qt, копировать их в дочерний процесс нельзя
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.directory = None
+        self.version = None
+        self.parts = []
+        self.products = []
+
+    def __enter__(self) -> 'ReportEngine':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def prepare(self) -> None:
+        # столбцы пишутся один раз на версию данных и переиспользуются всеми отчётами
+        version = source_key(self.source)
+        if self.directory is not None and version == self.version and version[1] is not None:
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='bakery_report_')
+        self.parts, self.products = write_columns(features(self.source), self.directory, self.partition)
+        self.version = version
+
+    def aggregate(self, by: str, with_products: bool=False) -> dict:
+        if by not in GROUPS:
+            raise ValueError(f'Unknown grouping: {by}')
+        self.prepare()
+        products = len(self.products) if with_products else 0
+        tasks = [(self.directory, start, stop, by, products) for start, stop in self.parts if stop > start]
+        partials = list(self.pool.map(partial, tasks))
+        return merge(partials, by)
+
+    def volume(self, by: str='month') -> pd.DataFrame:
+        totals = self.aggregate(by)
+        return pd.DataFrame({name: totals[name] for name in ('lines', 'orders', 'quantity', 'revenue')}, index=totals['index'])
+
+    def average_basket(self, by: str='month') -> pd.DataFrame:
+        totals = self.aggregate(by)
+        orders = totals['orders']
+        return pd.DataFrame({name: totals[name] / orders for name in ('lines', 'quantity', 'revenue')}, index=totals['index'])
+
+    def top_products(self, n: int=5, by: str='month') -> pd.DataFrame:
+        totals = self.aggregate(by, with_products=True)
+        quantity, revenue = totals['product_quantity'], totals['product_revenue']
+        # по каждой группе - n продуктов с наибольшим количеством, без продуктов, которых в группе не было
+        ranked = np.argsort(-quantity, axis=1, kind='stable')[:, :n]
+        rows = []
+        for i, period in enumerate(totals['index']):
+            for rank, code in enumerate(ranked[i], start=1):
+                if quantity[i, code] > 0:
+                    rows.append((period, rank, self.products[code], int(quantity[i, code]), revenue[i, code]))
+        return pd.DataFrame(rows, columns=[by, 'rank', 'product', 'quantity', 'revenue'])
+
+
+def merge(partials: list, by: str) -> dict:
+    # складывает частичные суммы по всем частям; группы разных частей могут совпадать (при разбиении
+    # по пекарне один месяц встречается в каждой части)
+    groups = np.unique(np.concatenate([part['groups'] for part in partials])) if partials else np.array([], dtype=np.int32)
+    totals = {}
+    for name in ('lines', 'orders', 'quantity', 'revenue', 'product_quantity', 'product_revenue'):
+        if name.startswith('product') and not (partials and name in partials[0]):
+            continue
+        totals[name] = np.zeros((len(groups),) + (partials[0][name].shape[1:] if partials else ()))
+        for part in partials:
+            totals[name][np.searchsorted(groups, part['groups'])] += part[name]
+    for name in ('lines', 'orders', 'quantity'):
+        if name in totals:
+            totals[name] = totals[name].astype(np.int64)
+    totals['index'] = pd.PeriodIndex.from_ordinals(groups, freq='M') if by == 'month' else pd.Index(groups, name=by)
+    if by == 'month':
+        totals['index'].name = by
+    return totals
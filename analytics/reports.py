@@ -0,0 +1,58 @@
+import pandas as pd
+
+from config import DATA_PATH
+
+from .features import features, orders
+
+PERIODS = ('hour', 'weekday', 'month')
+
+
+def _check_period(by: str) -> None:
+    if by not in PERIODS:
+        raise ValueError(f'Unknown period: {by}')
+
+
+def _between(data: pd.DataFrame, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    # вместо фильтра по номеру строки из блокнота (data.index <= 132027) - границы дат включительно
+    if date_from is not None:
+        data = data[data['date_time'] >= pd.Timestamp(date_from)]
+    if date_to is not None:
+        data = data[data['date_time'] < pd.Timestamp(date_to) + pd.Timedelta(days=1)]
+    return data
+
+
+def volume(by: str='hour', source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    # по периоду: lines - строк заказов (как считал блокнот), orders - заказов, quantity - штук, revenue - выручка
+    _check_period(by)
+    data = _between(orders(source), date_from, date_to)
+    return data.groupby(by).agg(lines=('lines', 'sum'), orders=('lines', 'size'),
+                                quantity=('quantity', 'sum'), revenue=('revenue', 'sum'))
+
+
+def hourly_volume(source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    return volume('hour', source, date_from, date_to)
+
+
+def weekday_volume(source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    return volume('weekday', source, date_from, date_to)
+
+
+def monthly_volume(source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    return volume('month', source, date_from, date_to)
+
+
+def average_basket(by: str='month', source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    # средний заказ за период: строк, штук и сумма
+    _check_period(by)
+    data = _between(orders(source), date_from, date_to)
+    return data.groupby(by)[['lines', 'quantity', 'revenue']].mean()
+
+
+def top_products(n: int=5, by: str='month', source=DATA_PATH, date_from: str=None, date_to: str=None) -> pd.DataFrame:
+    # n самых продаваемых по количеству продуктов в каждом периоде: period, rank, product, quantity, revenue
+    _check_period(by)
+    data = _between(features(source), date_from, date_to)
+    totals = data.groupby([by, 'product'], observed=True)[['quantity', 'revenue']].sum().reset_index()
+    totals = totals.sort_values([by, 'quantity'], ascending=[True, False], kind='stable')
+    top = totals.groupby(by, sort=False).head(n)
+    return top.assign(rank=top.groupby(by).cumcount() + 1)[[by, 'rank', 'product', 'quantity', 'revenue']].reset_index(drop=True)
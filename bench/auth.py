@@ -0,0 +1,38 @@
+# подбор стоимости хэширования паролей: python -m bench.auth [целевое время входа, мс]
+# печатает время проверки пароля для растущих параметров scrypt и pbkdf2 (до первого превышения цели)
+# и самые дорогие из тех, что в неё укладываются; выбранные значения записываются в config (SCRYPT_N, PBKDF2_ITERATIONS)
+import sys
+import time
+
+from db.auth import hash_password, verify_password
+
+
+def timing(kdf: str, runs: int=3, **params) -> float:
+    # лучшее из runs время проверки одного пароля, мс
+    stored = hash_password('till password', kdf, **params)
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        verify_password('till password', stored)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else 250
+    fits = {}
+    for power in range(12, 19):
+        elapsed = timing('scrypt', n=2 ** power, r=8, p=1)
+        print(f'scrypt n=2**{power:<2} r=8 p=1: {elapsed:8.1f} ms')
+        if elapsed > target:
+            break
+        fits['scrypt'] = f'SCRYPT_N = 2 ** {power}'
+    for iterations in (100000, 200000, 400000, 600000, 1000000, 2000000):
+        elapsed = timing('pbkdf2', iterations=iterations)
+        print(f'pbkdf2 iterations={iterations:<8}: {elapsed:8.1f} ms')
+        if elapsed > target:
+            break
+        fits['pbkdf2'] = f'PBKDF2_ITERATIONS = {iterations}'
+    for kdf, setting in fits.items():
+        print(f'{kdf}: {setting} (target {target:.0f} ms)')
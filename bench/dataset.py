@@ -0,0 +1,77 @@
+# синтетические продажи в формате Bakery_sales.csv: python -m bench.dataset <число строк> <файл> [seed]
+import sys
+
+import numpy as np
+import pandas as pd
+
+# (продукт, базовая цена, относительная популярность); DIVERS, TRAITEUR и нулевые цены нужны,
+# чтобы фильтр filter_data работал так же, как на настоящих данных
+PRODUCTS = [
+    ('TRADITIONAL BAGUETTE', 1.2, 120),
+    ('COUPE', 0.15, 60),
+    ('BAGUETTE', 0.9, 50),
+    ('BANETTE', 1.05, 30),
+    ('CROISSANT', 1.1, 30),
+    ('PAIN AU CHOCOLAT', 1.2, 25),
+    ('CEREAL BAGUETTE', 1.3, 10),
+    ('SPECIAL BREAD', 2.4, 8),
+    ('FORMULE SANDWICH', 7.0, 8),
+    ('TARTELETTE', 2.5, 7),
+    ('CAMPAGNE', 1.4, 6),
+    ('BOULE 400G', 1.5, 5),
+    ('ECLAIR', 2.0, 5),
+    ('PAIN', 1.15, 5),
+    ('DIVERS VIENNOISERIE', 1.0, 2),
+    ('DIVERS PATISSERIE', 2.0, 2),
+    ('TRAITEUR', 3.0, 1),
+]
+
+DAYS = pd.date_range('2021-01-02', periods=600, freq='D').strftime('%Y-%m-%d').to_numpy()
+CLOCK = np.array([f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(24 * 60)], dtype=object)
+FIRST_ORDER_ID = 150040
+
+
+def generate(path: str, lines: int, seed: int=0, block: int=500000) -> int:
+    # пишет около lines строк (последний заказ не режется) блоками по block строк; возвращает число заказов
+    rng = np.random.default_rng(seed)
+    names = np.array([name for name, _, _ in PRODUCTS], dtype=object)
+    prices = np.array([price for _, price, _ in PRODUCTS])
+    weights = np.array([weight for _, _, weight in PRODUCTS], dtype=float)
+    weights /= weights.sum()
+    # в среднем 2.5 строки на заказ, заказы равномерно раскладываются по дням
+    orders_per_day = lines * 2 // (5 * len(DAYS)) + 1
+
+    written = 0
+    order_id = FIRST_ORDER_ID
+    while written < lines:
+        sizes = rng.integers(1, 5, size=max(1, (min(block, lines - written) * 2) // 5))
+        sizes = sizes[:np.searchsorted(np.cumsum(sizes), lines - written) + 1]
+        count = int(sizes.sum())
+        ids = np.arange(order_id, order_id + len(sizes))
+        day = (ids - FIRST_ORDER_ID) // orders_per_day % len(DAYS)
+        time = CLOCK[rng.integers(7 * 60, 20 * 60, size=len(sizes))]
+
+        product = rng.choice(len(PRODUCTS), size=count, p=weights)
+        unit_price = prices[product].copy()
+        # изредка цена отличается от обычной, ещё реже позиция бесплатная
+        change = rng.random(count)
+        unit_price[change < 0.05] += 0.1
+        unit_price[change > 0.995] = 0
+        data = pd.DataFrame({
+            'date': np.repeat(DAYS[day], sizes),
+            'time': np.repeat(time, sizes),
+            'order_ID': np.repeat(ids, sizes),
+            'product': names[product],
+            'quantity': rng.choice([1, 1, 1, 2, 2, 3, 4], size=count),
+            'unit_price': unit_price.round(2),
+        })
+        data.to_csv(path, index=False, mode='w' if written == 0 else 'a', header=written == 0)
+        written += count
+        order_id += len(sizes)
+    return order_id - FIRST_ORDER_ID
+
+
+if __name__ == '__main__':
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    orders = generate(sys.argv[2], int(sys.argv[1]), seed)
+    print(f'{orders} orders written to {sys.argv[2]}')
@@ -0,0 +1,44 @@
+# скорость записи заказов в каждом режиме журнала: python -m bench.journal [число заказов]
+import os
+import sys
+import tempfile
+import time
+
+from PyQt5.QtSql import QSqlDatabase
+
+from db import DBRepo
+from db.repository import JOURNAL_MODES
+
+
+def run(mode: str, orders: int, lines: int=3) -> float:
+    path = os.path.join(tempfile.mkdtemp(), 'journal.db')
+    con = QSqlDatabase.addDatabase('QSQLITE', f'bench_{mode}')
+    con.setDatabaseName(path)
+    repo = DBRepo(con)
+    repo.create_tables()
+    repo.add_triggers()
+    repo.add_bakery('bench', 'bench')
+    for i in range(1, lines + 1):
+        repo.add_product(f'product {i}', 1, i)
+        repo.add_stock(i, orders * lines, 1)
+    repo.set_journal_mode(mode)
+
+    started = time.perf_counter()
+    con.transaction()
+    for order_id in range(1, orders + 1):
+        repo.add_order(1, '2021-01-01', '08:00', order_id)
+        for product_id in range(1, lines + 1):
+            repo.add_order_product(order_id, product_id, 1)
+    con.commit()
+    elapsed = time.perf_counter() - started
+
+    repo.close()
+    os.remove(path)
+    return orders * (lines + 1) / elapsed
+
+
+if __name__ == '__main__':
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    results = {mode: run(mode, orders) for mode in JOURNAL_MODES}
+    for mode, rate in results.items():
+        print(f'{mode:>8}: {rate:10.0f} rows/s ({rate / results["off"]:.2f} of off)')
@@ -0,0 +1,38 @@
+# масштабирование отчётов по числу процессов: python -m bench.reports [csv] [число строк, если csv нет]
+# сравнивает последовательный analytics.top_products с ReportEngine на 1, 2, 4 ... ядрах
+import os
+import sys
+import tempfile
+import time
+
+import analytics
+from analytics.parallel import ReportEngine
+
+from . import dataset
+
+
+def run(path: str) -> None:
+    analytics.features(path)
+    started = time.perf_counter()
+    analytics.monthly_volume(path)
+    analytics.top_products(5, 'month', path)
+    print(f'serial: {time.perf_counter() - started:.3f} s')
+    workers = 1
+    while workers <= os.cpu_count():
+        with ReportEngine(path, 'month', workers) as engine:
+            # первый отчёт пишет столбцы и запускает процессы, его не считаем
+            engine.volume('month')
+            started = time.perf_counter()
+            engine.volume('month')
+            engine.top_products(5, 'month')
+            print(f'{workers:3d} workers: {time.perf_counter() - started:.3f} s')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        run(sys.argv[1])
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'Bakery_sales.csv')
+        dataset.generate(path, int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
+        run(path)
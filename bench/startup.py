@@ -0,0 +1,50 @@
+# время запуска приложения: python -m bench.startup [число запусков]
+# importtime - суммарное время импортов main по python -X importtime, first_window - от старта
+# интерпретатора до первого показанного окна (окно рисуется offscreen)
+import os
+import subprocess
+import sys
+import time
+
+FIRST_WINDOW = """
+import time
+started = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication([])
+import main
+window = main.MainWindow()
+window.show()
+app.processEvents()
+print(time.perf_counter() - started)
+window.close()
+"""
+
+
+def import_times() -> dict:
+    # {модуль: собственное время импорта, мкс} из вывода -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], capture_output=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(own)
+    return times
+
+
+def first_window() -> float:
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', FIRST_WINDOW], env=env, capture_output=True, check=True)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    times = import_times()
+    heavy = [name for name in ('pandas', 'numpy', 'pyarrow') if name in times]
+    print(f'importtime: {sum(times.values()) / 1e6:.3f} s, heavy modules: {", ".join(heavy) or "none"}')
+    for name, own in sorted(times.items(), key=lambda item: -item[1])[:10]:
+        print(f'  {own / 1e3:8.1f} ms  {name}')
+    windows = sorted(first_window() for _ in range(runs))
+    print(f'first_window: median {windows[len(windows) // 2]:.3f} s, best {windows[0]:.3f} s over {runs} runs')
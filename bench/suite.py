@@ -0,0 +1,157 @@
+# полный прогон бенчмарков на синтетических данных: python -m bench.suite [--lines N] [--out файл] [--compare старый.json]
+# этапы: разбор csv через DF, пересоздание базы (_reseed), запись заказов через add_order/add_order_product,
+# задержки get_orders/get_order/get_order_price; результаты пишутся в json, чтобы сравнивать версии
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtSql import QSqlDatabase
+
+from config import CHUNK_SIZE
+from db import DBRepo
+from db.profiling import percentile
+
+from . import dataset
+
+
+def timed(run) -> float:
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def latency(run, args: list) -> dict:
+    # задержки одного вызова, мс
+    times = sorted(timed(lambda: run(*arg)) * 1000 for arg in args)
+    return {'calls': len(times), 'p50': percentile(times, 50), 'p90': percentile(times, 90),
+            'p99': percentile(times, 99), 'max': times[-1]}
+
+
+def bench_parse(path: str) -> dict:
+    from raw_data import DF, prepare_data
+
+    def stream():
+        data = DF(path, chunksize=CHUNK_SIZE)
+        data.get_products()
+        for _ in data.iter_orders():
+            pass
+
+    def eager():
+        data = DF(path)
+        data.get_products()
+        data.get_orders()
+
+    results = {'csv_chunks': timed(lambda: sum(len(chunk) for chunk in prepare_data.read_csv_chunks(path)))}
+    if prepare_data.cache.available():
+        results['cache_build'] = timed(lambda: prepare_data.build_cache(path))
+    results['stream'] = timed(stream)
+    results['eager'] = timed(eager)
+    return results
+
+
+def bench_writes(repo: DBRepo, orders: int, lines: int=3) -> dict:
+    # как в окне кассы: каждый вызов - отдельная транзакция. Склада хватает ровно на замер, и любая
+    # неудачная запись останавливает прогон, чтобы в json не попала скорость отклонённых вставок
+    products = list(range(1, lines + 1))
+    for product_id in products:
+        repo.set_stock(product_id, orders)
+    started = time.perf_counter()
+    for _ in range(orders):
+        order_id = repo.add_order(1)
+        if not order_id:
+            raise RuntimeError('add_order failed')
+        for product_id in products:
+            if not repo.add_order_product(order_id, product_id, 1):
+                raise RuntimeError(f'add_order_product failed: order {order_id}, product {product_id}')
+    elapsed = time.perf_counter() - started
+    return {'orders': orders, 'orders_per_s': orders / elapsed, 'rows_per_s': orders * (lines + 1) / elapsed}
+
+
+def bench_reads(repo: DBRepo, samples: int) -> dict:
+    repo.query.exec('SELECT MIN(id), MAX(id) FROM orders')
+    repo.query.next()
+    first, last = repo.query.value(0), repo.query.value(1)
+    ids = [(random.randint(first, last),) for _ in range(samples)]
+    return {
+        'get_orders': latency(repo.get_orders, [(1,)] * 3),
+        'get_order': latency(repo.get_order, ids),
+        'get_order_price': latency(repo.get_order_price, ids),
+    }
+
+
+def run(lines: int, orders: int, samples: int, seed: int=0) -> dict:
+    random.seed(seed)
+    workdir = tempfile.mkdtemp(prefix='bakery_bench_')
+    try:
+        path = os.path.join(workdir, 'Bakery_sales.csv')
+        results = {'dataset': timed(lambda: dataset.generate(path, lines, seed))}
+        results['parse'] = bench_parse(path)
+
+        con = QSqlDatabase.addDatabase('QSQLITE', 'bench_suite')
+        con.setDatabaseName(os.path.join(workdir, 'bakery.db'))
+        repo = DBRepo(con, storage_mode='single')
+        results['reseed'] = timed(lambda: repo._reseed(path))
+        results['reads'] = bench_reads(repo, samples)
+        results['writes'] = bench_writes(repo, orders)
+        del con
+        QSqlDatabase.removeDatabase(repo.release())
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def revision() -> str:
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def flatten(results: dict, prefix: str='') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old: dict, new: dict) -> None:
+    # отношение new/old по каждой метрике; для *_per_s больше - лучше, для остальных (секунды, мс) - хуже
+    old, new = flatten(old['results']), flatten(new['results'])
+    for key, value in new.items():
+        if key in old and old[key] and not key.endswith(('.calls', '.orders')):
+            print(f'{key:32} {old[key]:12.4f} -> {value:12.4f}  x{value / old[key]:.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000, help='строк в синтетическом csv (10k - 10M)')
+    parser.add_argument('--orders', type=int, default=1000, help='заказов для замера записи')
+    parser.add_argument('--samples', type=int, default=1000, help='вызовов get_order/get_order_price')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', help='json предыдущего прогона')
+    options = parser.parse_args()
+
+    report = {
+        'revision': revision(),
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'lines': options.lines,
+        'results': run(options.lines, options.orders, options.samples, options.seed),
+    }
+    with open(options.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['results'], indent=2))
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), report)
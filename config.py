@@ -1 +1,36 @@
-DB_PATH = './db/bakery.db'
\ No newline at end of file
+DB_PATH = './db/bakery.db'
+DATA_PATH = './raw_data/Bakery_sales.csv'
+RAW_DATA_PATH = './raw_data/Bakery sales.csv.bak'
+CHUNK_SIZE = 50000  # строк в чанке при потоковом чтении csv
+JOURNAL_MODE = 'row'  # журнал изменений: row, summary или off
+LOG_MAX_ROWS = 1000000  # сколько последних записей logs хранить при очистке
+LOG_MAX_AGE_DAYS = 365
+STORAGE_MODE = 'single'  # single - всё в DB_PATH, sharded - заказы и склад каждой пекарни в своём файле
+SHARD_PATH = './db/bakery_{}.db'
+
+# настройки каждого соединения SQLite: WAL даёт читать параллельно с записью
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,  # в КБ, 16 МБ
+    'mmap_size': 268435456,  # 256 МБ
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # мс ожидания блокировки писателем
+}
+POOL_READERS = 4
+
+PROFILE_QUERIES = False  # записывать время каждого вызова DBRepo и запроса в db.profiling.profiler
+SLOW_QUERY_MS = 100  # запросы дольше этого попадают в лог вместе с планом
+PROFILE_MODE = None  # None, 'cprofile' или 'pyinstrument' - профилировать действия окна целиком
+
+STOCK_REFRESH_MS = 2000  # как часто панель склада дочитывает изменившиеся остатки
+
+# хэши паролей: 'scrypt' или 'pbkdf2'; параметры записываются в хэш каждого пользователя,
+# поэтому их можно менять - старые хэши проверяются со своими и пересчитываются при входе.
+# Подобрать под время входа на кассе: python -m bench.auth [мс]
+PASSWORD_KDF = 'scrypt'
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SESSION_TTL_MINUTES = 8 * 60  # сколько живёт токен входа без повторной проверки пароля
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+
+from config import PASSWORD_KDF, PBKDF2_ITERATIONS, SCRYPT_N, SCRYPT_P, SCRYPT_R, SESSION_TTL_MINUTES
+
+KDFS = ('scrypt', 'pbkdf2')
+
+
+def default_params(kdf: str=PASSWORD_KDF) -> dict:
+    if kdf == 'scrypt':
+        return {'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+    if kdf == 'pbkdf2':
+        return {'iterations': PBKDF2_ITERATIONS}
+    raise ValueError(f'Unknown password KDF: {kdf}')
+
+
+def _derive(kdf: str, password: str, salt: bytes, params: dict) -> bytes:
+    if kdf == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        # scrypt занимает 128 * r * n байт; по умолчанию hashlib разрешает только 32 МБ
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['iterations'])
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password: str, kdf: str=PASSWORD_KDF, **params) -> str:
+    # 'scrypt$n=16384,r=8,p=1$соль$хэш' - алгоритм и параметры хранятся вместе с хэшем
+    params = params or default_params(kdf)
+    salt = secrets.token_bytes(16)
+    settings = ','.join(f'{name}={value}' for name, value in params.items())
+    return f'{kdf}${settings}${_b64(salt)}${_b64(_derive(kdf, password, salt, params))}'
+
+
+def parse_hash(stored: str) -> tuple:
+    # (алгоритм, параметры, соль, хэш); ValueError для старых значений str(hash(password))
+    kdf, settings, salt, digest = stored.split('$')
+    if kdf not in KDFS:
+        raise ValueError(f'Unknown password KDF: {kdf}')
+    params = {name: int(value) for name, value in (item.split('=') for item in settings.split(','))}
+    if params.keys() != default_params(kdf).keys():
+        raise ValueError(f'Bad {kdf} parameters: {settings}')
+    return kdf, params, base64.b64decode(salt), base64.b64decode(digest)
+
+
+def verify_password(password: str, stored: str) -> bool:
+    try:
+        kdf, params, salt, digest = parse_hash(stored)
+        # недопустимые значения параметров (например, n у scrypt не степень двойки) hashlib отвергает с ValueError
+        derived = _derive(kdf, password, salt, params)
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, digest)
+
+
+def needs_rehash(stored: str) -> bool:
+    # хэш посчитан с другими параметрами, чем сейчас в config
+    try:
+        kdf, params, _, _ = parse_hash(stored)
+    except ValueError:
+        return True
+    return kdf != PASSWORD_KDF or params != default_params()
+
+
+class Auth:
+    # вход по логину и паролю. Пароль проверяется один раз, дальше действия кассы предъявляют токен
+    # сессии, и KDF повторно не считается. Сессии живут в памяти процесса до истечения срока
+    def __init__(self, repo, ttl_minutes: int=SESSION_TTL_MINUTES) -> None:
+        self.repo = repo
+        self.ttl = ttl_minutes * 60
+        self.sessions = {}
+        # для несуществующего логина проверяется этот хэш, чтобы по времени ответа нельзя было перебирать логины
+        self.dummy = hash_password(secrets.token_hex(8))
+
+    def login(self, login: str, password: str) -> str:
+        # токен сессии или None, если логин или пароль неверны
+        user = self.repo.get_user(login)
+        if user is None:
+            verify_password(password, self.dummy)
+            return None
+        if not verify_password(password, user.password):
+            return None
+        if needs_rehash(user.password):
+            self.repo.set_password(user.id, password)
+        token = secrets.token_urlsafe(32)
+        # хэш пароля сессии не нужен: в памяти он не хранится и наружу через user() не отдаётся
+        self.sessions[token] = (user._replace(password=None), time.monotonic() + self.ttl)
+        return token
+
+    def user(self, token: str):
+        # пользователь сессии или None, если токен неизвестен или истёк
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        user, expires = session
+        if time.monotonic() > expires:
+            del self.sessions[token]
+            return None
+        return user
+
+    def logout(self, token: str) -> None:
+        self.sessions.pop(token, None)
+
+    def purge(self) -> None:
+        now = time.monotonic()
+        for token in [token for token, (_, expires) in self.sessions.items() if now > expires]:
+            del self.sessions[token]
\ No newline at end of file
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    # ограниченный кэш: при переполнении вытесняется давно не использованная запись;
+    # запись хранится вместе с версией данных и считается промахом, если версия изменилась;
+    # версия None значит, что отследить изменения нельзя, и такие записи не кэшируются
+    missing = object()
+
+    def __init__(self, maxsize: int=256) -> None:
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        entry = self.data.get(key)
+        if entry is None or version is None or entry[0] != version:
+            self.misses += 1
+            return self.missing
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value) -> None:
+        if version is None:
+            return
+        self.data[key] = (version, value)
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
@@ -0,0 +1,14 @@
+# проверка планов горячих запросов: python -m db.check_plans
+# код возврата 1, если какой-то запрос читает таблицу целиком
+import sys
+
+from db import DBRepo
+
+
+if __name__ == '__main__':
+    repo = DBRepo()
+    offenders = repo.check_query_plans()
+    for name, steps in offenders.items():
+        print(f'{name}: {"; ".join(steps)}')
+    print('Query plans OK' if not offenders else f'{len(offenders)} queries fall back to a full scan')
+    sys.exit(1 if offenders else 0)
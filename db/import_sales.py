@@ -0,0 +1,10 @@
+# дозагрузка новой выгрузки продаж: python -m db.import_sales <файл.csv> [id пекарни]
+import sys
+
+from db import DBRepo
+
+
+if __name__ == '__main__':
+    bakery_id = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    repo = DBRepo()
+    repo.import_sales(sys.argv[1], bakery_id)
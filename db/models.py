@@ -0,0 +1,135 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from .worker import AsyncRepo
+
+
+class OrdersModel(QAbstractTableModel):
+    # список заказов подгружается страницами по мере прокрутки, в памяти только показанные строки
+    headers = ['Номер заказа', 'Дата', 'Время']
+
+    def __init__(self, repo, bakery_id: int=1, page_size: int=500, parent=None) -> None:
+        # repo - DBRepo (страница читается сразу) или AsyncRepo (страница читается в фоновом потоке)
+        super().__init__(parent)
+        self.repo = repo
+        self.bakery_id = bakery_id
+        self.page_size = page_size
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return str(self.rows[index.row()][index.column()])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()) -> None:
+        if parent.isValid():
+            return
+        after_id = self.rows[-1][0] if self.rows else 0
+        if isinstance(self.repo, AsyncRepo):
+            self.loading = True
+            self.repo.call('orders_page', 'get_orders_page', self.bakery_id, after_id, self.page_size, callback=self.add_page)
+        else:
+            self.add_page(self.repo.get_orders_page(self.bakery_id, after_id, self.page_size))
+
+    def add_page(self, page: list) -> None:
+        self.loading = False
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def order_id(self, row: int) -> int:
+        return self.rows[row][0]
+
+    def reload(self) -> None:
+        if isinstance(self.repo, AsyncRepo):
+            self.repo.cancel('orders_page')
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+
+
+class StockModel(QAbstractTableModel):
+    # остатки пекарни: полный снимок при reload(), дальше refresh() дочитывает только строки,
+    # изменившиеся после последней известной версии склада, и обновляет их ячейки на месте
+    headers = ['ID', 'Название', 'Количество']
+
+    def __init__(self, repo, bakery_id: int=1, parent=None) -> None:
+        # repo - DBRepo или AsyncRepo, как у OrdersModel
+        super().__init__(parent)
+        self.repo = repo
+        self.bakery_id = bakery_id
+        self.rows = []
+        self.row_of = {}
+        self.version = 0
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return str(self.rows[index.row()][index.column()])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def reload(self) -> None:
+        if isinstance(self.repo, AsyncRepo):
+            self.repo.call('stock', 'get_stock_snapshot', self.bakery_id, callback=self.set_snapshot)
+        else:
+            self.set_snapshot(self.repo.get_stock_snapshot(self.bakery_id))
+
+    def refresh(self) -> None:
+        if isinstance(self.repo, AsyncRepo):
+            self.repo.call('stock_changes', 'get_stock_changes', self.bakery_id, self.version, callback=self.apply_changes)
+        else:
+            self.apply_changes(self.repo.get_stock_changes(self.bakery_id, self.version))
+
+    def set_snapshot(self, snapshot: tuple) -> None:
+        version, rows = snapshot
+        self.beginResetModel()
+        self.rows = [list(row) for row in rows]
+        self.row_of = {row[0]: i for i, row in enumerate(self.rows)}
+        self.version = version
+        self.endResetModel()
+
+    def apply_changes(self, changes: tuple) -> None:
+        version, quantities = changes
+        if version <= self.version:
+            return
+        if any(product_id not in self.row_of for product_id in quantities):
+            # на складе появился новый продукт - нужна строка с названием, проще перечитать снимок
+            self.reload()
+            return
+        self.version = version
+        for product_id, quantity in quantities.items():
+            row = self.row_of[product_id]
+            self.rows[row][2] = quantity
+            cell = self.index(row, 2)
+            self.dataChanged.emit(cell, cell, [Qt.DisplayRole])
@@ -0,0 +1,56 @@
+import threading
+from contextlib import contextmanager
+
+from PyQt5.QtSql import QSqlDatabase
+
+from config import DB_PATH, POOL_READERS
+
+from .repository import DBRepo
+
+
+class ConnectionPool:
+    # одно соединение-писатель и до readers одновременно работающих читателей. В режиме WAL читатели
+    # не ждут писателя, а писатель - читателей, поэтому отчёты строятся параллельно с приёмом заказов.
+    # Соединение Qt можно использовать только в потоке, где оно создано, поэтому каждый поток получает
+    # свои соединения; пул ограничивает, сколько из них работает одновременно
+    def __init__(self, path: str=DB_PATH, readers: int=POOL_READERS, name: str='bakery_pool') -> None:
+        self.path = path
+        self.name = name
+        self.write_lock = threading.Lock()
+        self.read_slots = threading.BoundedSemaphore(readers)
+        self.repos = {}
+        self.repos_lock = threading.Lock()
+
+    def _repo(self, role: str) -> DBRepo:
+        key = (role, threading.get_ident())
+        with self.repos_lock:
+            repo = self.repos.get(key)
+        if repo is None:
+            con = QSqlDatabase.addDatabase('QSQLITE', f'{self.name}_{role}_{key[1]}')
+            con.setDatabaseName(self.path)
+            repo = DBRepo(con)
+            if role == 'reader':
+                repo.query.exec("PRAGMA query_only = 1")
+            with self.repos_lock:
+                self.repos[key] = repo
+        return repo
+
+    @contextmanager
+    def writer(self):
+        with self.write_lock:
+            yield self._repo('writer')
+
+    @contextmanager
+    def reader(self):
+        with self.read_slots:
+            yield self._repo('reader')
+
+    def release_thread(self) -> None:
+        # закрывает соединения текущего потока; вызывать из потока перед его завершением, вне блоков
+        # writer()/reader(). Выданные репозитории после этого использовать нельзя
+        ident = threading.get_ident()
+        for role in ('writer', 'reader'):
+            with self.repos_lock:
+                repo = self.repos.pop((role, ident), None)
+            if repo is not None:
+                QSqlDatabase.removeDatabase(repo.release())
@@ -0,0 +1,173 @@
+import functools
+import inspect
+import logging
+import time
+from collections import deque
+
+from config import PROFILE_MODE, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+
+class QueryProfiler:
+    # кольцевой буфер последних вызовов репозитория и запросов: (вид, имя, время в с, число строк).
+    # Вид 'call' - метод DBRepo, имя - название метода; 'statement' - запрос, имя - текст SQL
+    def __init__(self, size: int=10000, slow_ms: float=SLOW_QUERY_MS) -> None:
+        self.records = deque(maxlen=size)
+        self.slow_ms = slow_ms
+
+    def record(self, kind: str, name: str, elapsed: float, rows: int) -> None:
+        self.records.append((kind, name, elapsed, rows))
+
+    def record_statement(self, repo, sql: str, elapsed: float, rows: int) -> None:
+        self.record('statement', sql, elapsed, rows)
+        # план самого EXPLAIN не нужен, иначе запись медленного запроса зациклится
+        if elapsed * 1000 >= self.slow_ms and not sql.startswith('EXPLAIN'):
+            plan = '; '.join(repo.explain(sql))
+            logger.warning('Slow query %.1f ms, %d rows: %s | plan: %s', elapsed * 1000, rows, ' '.join(sql.split()), plan)
+
+    def summary(self, kind: str=None) -> dict:
+        # {имя: {'count', 'p50', 'p90', 'p99', 'max' (мс), 'rows'}}
+        times = {}
+        rows = {}
+        for record_kind, name, elapsed, count in list(self.records):
+            if kind is None or record_kind == kind:
+                times.setdefault(name, []).append(elapsed * 1000)
+                rows[name] = rows.get(name, 0) + max(count, 0)
+        summary = {}
+        for name, values in times.items():
+            values.sort()
+            summary[name] = {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+                'rows': rows[name],
+            }
+        return summary
+
+    def report(self, kind: str=None, top: int=20) -> str:
+        lines = []
+        summary = sorted(self.summary(kind).items(), key=lambda item: -item[1]['p90'])
+        for name, stats in summary[:top]:
+            name = ' '.join(name.split())
+            lines.append(f"{stats['count']:6d} x  p50 {stats['p50']:8.2f}  p90 {stats['p90']:8.2f}  p99 {stats['p99']:8.2f} ms  {name[:100]}")
+        return '\n'.join(lines)
+
+    def clear(self) -> None:
+        self.records.clear()
+
+
+def percentile(values: list, point: float) -> float:
+    # значение ранга point из отсортированного списка
+    index = max(0, min(len(values) - 1, round(point / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+# число строк в результатах, которые не являются списком или словарём строк; -1 - строки не считаются
+RESULT_ROWS = {
+    'get_product': lambda product: 1,
+    'get_user': lambda user: int(user is not None),
+    'get_order_detail': lambda detail: len(detail[0]),
+    'get_stock_snapshot': lambda snapshot: len(snapshot[1]),
+    'get_stock_changes': lambda changes: len(changes[1]),
+}
+
+
+def result_rows(name: str, result) -> int:
+    if name in RESULT_ROWS:
+        return RESULT_ROWS[name](result)
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return -1
+
+
+def instrument(repo, profiler: QueryProfiler) -> None:
+    # оборачивает публичные методы этого экземпляра DBRepo и все его запросы
+    repo.statements.profiler = profiler
+    for name in dir(type(repo)):
+        method = getattr(repo, name)
+        if name.startswith('_') or not callable(method) or name in ('explain', 'enable_profiling', 'shard', 'shards', 'release'):
+            continue
+        setattr(repo, name, _timed_call(profiler, name, method))
+
+
+def _timed_call(profiler: QueryProfiler, name: str, method):
+    @functools.wraps(method)
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        result = method(*args, **kwargs)
+        if inspect.isgenerator(result):
+            return _timed_generator(profiler, name, result)
+        profiler.record('call', name, time.perf_counter() - started, result_rows(name, result))
+        return result
+    return call
+
+
+def _timed_generator(profiler: QueryProfiler, name: str, generator):
+    # генератор (iter_orders) записывается, когда его дочитали или закрыли: время - только внутри
+    # самого генератора, без обработки строк вызывающим кодом, строки - сколько их было прочитано
+    elapsed = 0.0
+    rows = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                return
+            elapsed += time.perf_counter() - started
+            rows += 1
+            yield item
+    finally:
+        generator.close()
+        profiler.record('call', name, elapsed, rows)
+
+
+def profile_call(name: str, call, mode: str=PROFILE_MODE, top: int=25):
+    # выполняет call() и в режиме cprofile или pyinstrument печатает его профиль. Профилировщики видят
+    # только свой поток, поэтому работа DBWorker профилируется в его потоке, а не в действии окна.
+    # Модули профилировщиков импортируются только при включённом профилировании, чтобы не замедлять запуск
+    if mode is None:
+        return call()
+    if mode == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return call()
+        finally:
+            profiler.stop()
+            print(profiler.output_text(unicode=True))
+    import cProfile
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return call()
+    finally:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        print(f'--- {name} ---\n{out.getvalue()}')
+
+
+def profile_action(mode: str=PROFILE_MODE, top: int=25):
+    # декоратор для синхронных действий окна; запросы через AsyncRepo выполняются в DBWorker
+    # и профилируются там же (см. DBWorker.run)
+    def decorator(action):
+        if mode is None:
+            return action
+
+        @functools.wraps(action)
+        def profiled(*args, **kwargs):
+            return profile_call(action.__qualname__, lambda: action(*args, **kwargs), mode, top)
+        return profiled
+    return decorator
+
+
+# общий профилировщик: его включает DBRepo при PROFILE_QUERIES = True
+profiler = QueryProfiler()
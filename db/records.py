@@ -0,0 +1,30 @@
+from typing import NamedTuple
+
+
+# строки результатов репозитория: кортеж с именованными полями занимает в несколько раз меньше словаря
+class Order(NamedTuple):
+    id: int
+    bakery_id: int
+    date: str
+    time: str
+
+
+class OrderLine(NamedTuple):
+    name: str
+    quantity: int
+    price: float
+
+
+class StockItem(NamedTuple):
+    id: int
+    name: str
+    quantity: int
+
+
+class User(NamedTuple):
+    id: int
+    bakery_id: int
+    role_id: int
+    name: str
+    login: str
+    password: str  # хэш из db.auth.hash_password
\ No newline at end of file
@@ -1,17 +1,228 @@
 import datetime
+import functools
+import inspect
+import re
 import sys
+import time
 from PyQt5.QtSql import QSqlDatabase, QSqlQuery
 from decimal import Decimal
+from typing import TYPE_CHECKING
 
-from anyio import start_blocking_portal
+from config import (CHUNK_SIZE, DATA_PATH, DB_PATH, JOURNAL_MODE, LOG_MAX_AGE_DAYS, LOG_MAX_ROWS, PROFILE_QUERIES, SQLITE_PRAGMAS,
+                    STORAGE_MODE)
 
-from config import DB_PATH
+from .auth import hash_password
+from .cache import LRUCache
+from .records import Order, OrderLine, StockItem, User
+from .statements import StatementCache
+
+if TYPE_CHECKING:
+    # pandas и numpy при старте приложения не загружаются, тип нужен только для аннотации
+    from raw_data import OrderColumns
+
+    from .shards import ShardRouter
+
+
+# каждое изменение остатка получает следующий номер версии в своей пекарне; по индексу
+# (bakery_id, version) панель склада дочитывает только изменившиеся строки
+STOCK_VERSION = "version = (SELECT MAX(s.version) + 1 FROM stock s WHERE s.bakery_id = stock.bakery_id)"
+
+# цена строки заказа {line} (продукт - под псевдонимом p): price_change, а если она не задана или равна нулю -
+# цена по умолчанию, как с самого начала считал get_order. Все суммы и отчёты берут цену только отсюда
+LINE_PRICE = "COALESCE(NULLIF({line}.price_change, 0), p.price)"
+
+# индексы, которыми управляет репозиторий: (имя, таблица, столбцы, уникальный)
+INDEXES = [
+    ('idx_orders_bakery_date', 'orders', ('bakery_id', 'date', 'time'), False),
+    ('idx_orders_bakery_id', 'orders', ('bakery_id', 'id'), False),
+    ('idx_order_product_product', 'order_product', ('product_id', 'order_id', 'quantity', 'price_change'), False),
+    ('ux_products_name', 'products', ('name',), True),
+    ('idx_stock_version', 'stock', ('bakery_id', 'version'), False),
+    ('idx_logs_table', 'logs', ('table_name', 'id'), False),
+]
+
+# доля строки заказа {row} в sales_hourly со знаком {sign}; WHERE true нужен SQLite для UPSERT после SELECT
+SALES_UPSERT = f"""
+    INSERT INTO sales_hourly (bakery_id, date, hour, product_id, lines, quantity, revenue)
+    SELECT o.bakery_id, o.date, CAST(substr(o.time, 1, 2) AS INTEGER), {{row}}.product_id,
+        {{sign}}, {{sign}} * {{row}}.quantity,
+        {{sign}} * {{row}}.quantity * CAST(ROUND({LINE_PRICE.format(line='{row}')} * 100) AS INTEGER)
+    FROM orders o, products p
+    WHERE o.id = {{row}}.order_id AND p.id = {{row}}.product_id AND true
+    ON CONFLICT (bakery_id, date, hour, product_id) DO UPDATE SET
+        lines = lines + excluded.lines,
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue;
+"""
+
+# доля всех строк заказа {row} (строка orders) в sales_hourly со знаком {sign} - при переносе и удалении заказа
+ORDER_SALES_UPSERT = f"""
+    INSERT INTO sales_hourly (bakery_id, date, hour, product_id, lines, quantity, revenue)
+    SELECT {{row}}.bakery_id, {{row}}.date, CAST(substr({{row}}.time, 1, 2) AS INTEGER), op.product_id,
+        {{sign}}, {{sign}} * op.quantity,
+        {{sign}} * op.quantity * CAST(ROUND({LINE_PRICE.format(line='op')} * 100) AS INTEGER)
+    FROM order_product op, products p
+    WHERE op.order_id = {{row}}.id AND p.id = op.product_id AND true
+    ON CONFLICT (bakery_id, date, hour, product_id) DO UPDATE SET
+        lines = lines + excluded.lines,
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue;
+"""
+
+# sales_hourly заново из строк заказов, {condition} - какие строки order_product пересчитываются
+SALES_REBUILD = f"""
+    INSERT INTO sales_hourly (bakery_id, date, hour, product_id, lines, quantity, revenue)
+    SELECT o.bakery_id, o.date, CAST(substr(o.time, 1, 2) AS INTEGER), op.product_id,
+        COUNT(*), SUM(op.quantity),
+        SUM(op.quantity * CAST(ROUND({LINE_PRICE.format(line='op')} * 100) AS INTEGER))
+    FROM order_product op
+    JOIN orders o ON o.id = op.order_id
+    JOIN products p ON p.id = op.product_id
+    WHERE {{condition}}
+    GROUP BY 1, 2, 3, 4;
+"""
+
+# группировки для get_sales: выражение над sales_hourly (день недели: 0 - понедельник, как в pandas)
+SALES_GROUPS = {
+    'date': "date",
+    'hour': "hour",
+    'weekday': "(CAST(strftime('%w', date) AS INTEGER) + 6) % 7",
+    # месяц года (1-12) объединяет одинаковые месяцы разных лет; период год-месяц - year_month
+    'month_of_year': "CAST(strftime('%m', date) AS INTEGER)",
+    'year_month': "substr(date, 1, 7)",
+    'date_hour': "date || ' ' || printf('%02d', hour)",
+    'product': "product_id",
+}
+
+SALES_QUERY = """--sql
+    SELECT {group}, SUM(lines), SUM(quantity), SUM(revenue) FROM sales_hourly
+    WHERE bakery_id = :bakery_id AND date BETWEEN :date_from AND :date_to
+    GROUP BY 1 ORDER BY 1
+"""
+
+# отчёты целиком считаются в SQLite, в Python приходят только итоговые строки.
+# {group} - выражение из SALES_GROUPS; деньги - в центах, как в sales_hourly
+
+# n самых продаваемых продуктов в каждом периоде: ранг по количеству считает оконная функция
+TOP_PRODUCTS_QUERY = """--sql
+    SELECT period, rank, name, quantity, revenue FROM (
+        SELECT {group} AS period, p.name AS name, SUM(s.quantity) AS quantity, SUM(s.revenue) AS revenue,
+            ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY SUM(s.quantity) DESC, s.product_id) AS rank
+        FROM sales_hourly s JOIN products p ON p.id = s.product_id
+        WHERE s.bakery_id = :bakery_id AND s.date BETWEEN :date_from AND :date_to
+        GROUP BY 1, s.product_id
+    )
+    WHERE rank <= :top
+    ORDER BY period, rank
+"""
+
+# средний заказ за период: сначала итоги каждого заказа, потом их средние
+BASKET_QUERY = f"""--sql
+    SELECT {{group}}, COUNT(*), AVG(lines), AVG(quantity), AVG(revenue) FROM (
+        SELECT o.date AS date, CAST(substr(o.time, 1, 2) AS INTEGER) AS hour, COUNT(*) AS lines,
+            SUM(op.quantity) AS quantity,
+            SUM(op.quantity * CAST(ROUND({LINE_PRICE.format(line='op')} * 100) AS INTEGER)) AS revenue
+        FROM orders o JOIN order_product op ON op.order_id = o.id JOIN products p ON p.id = op.product_id
+        WHERE o.bakery_id = :bakery_id AND o.date BETWEEN :date_from AND :date_to
+        -- date и time впереди, чтобы заказы шли в порядке индекса (bakery_id, date, time) и диапазон дат читался по нему
+        GROUP BY o.date, o.time, o.id
+    )
+    GROUP BY 1 ORDER BY 1
+"""
+
+# как часто у продукта цена в заказе отличается от цены по умолчанию (нулевая price_change - не другая цена)
+PRICE_CHANGE_QUERY = """--sql
+    SELECT p.name, p.price, COUNT(*), COUNT(NULLIF(op.price_change, 0)), AVG(NULLIF(op.price_change, 0))
+    FROM orders o JOIN order_product op ON op.order_id = o.id JOIN products p ON p.id = op.product_id
+    WHERE o.bakery_id = :bakery_id AND o.date BETWEEN :date_from AND :date_to
+    GROUP BY op.product_id
+    ORDER BY 1.0 * COUNT(NULLIF(op.price_change, 0)) / COUNT(*) DESC, p.name
+"""
+
+# запросы горячего пути; check_query_plans следит, чтобы ни один не уходил в полный просмотр таблицы
+HOT_QUERIES = {
+    'get_product': "SELECT * FROM products WHERE name=:name",
+    'get_user': "SELECT id, bakery_id, role_id, name, login, password FROM users WHERE login=:login",
+    'get_orders': "SELECT id, bakery_id, date, time FROM orders WHERE bakery_id=:bakery_id",
+    'get_orders_page': "SELECT id, date, time FROM orders WHERE bakery_id=:bakery_id AND id>:after_id ORDER BY id LIMIT :limit",
+    'get_order': "SELECT (SELECT name FROM products WHERE id=product_id), quantity, (SELECT price FROM products WHERE id=product_id), price_change FROM order_product WHERE order_id=:order_id",
+    'get_order_price': f"SELECT SUM({LINE_PRICE.format(line='op')} * op.quantity) FROM order_product op JOIN products p ON p.id = op.product_id WHERE op.order_id=:order_id",
+    # строки заказа и итог одним запросом; итог считается в центах, чтобы сумма была точной
+    'get_order_detail': f"""--sql
+        SELECT p.name, op.quantity, {LINE_PRICE.format(line='op')},
+            SUM(CAST(ROUND({LINE_PRICE.format(line='op')} * 100) AS INTEGER) * op.quantity) OVER ()
+        FROM order_product op JOIN products p ON p.id = op.product_id
+        WHERE op.order_id = :order_id
+        """,
+    'get_stock': "SELECT s.product_id, p.name, s.quantity FROM stock s JOIN products p ON p.id = s.product_id WHERE s.bakery_id=:bakery_id ORDER BY s.product_id",
+    # остатки, изменившиеся после версии since, - для обновления панели склада без полной перезагрузки
+    'get_stock_changes': "SELECT product_id, quantity, version FROM stock WHERE bakery_id=:bakery_id AND version>:since",
+    'stock_version': "SELECT MAX(version) FROM stock WHERE bakery_id=:bakery_id",
+    'get_sales': SALES_QUERY.format(group=SALES_GROUPS['hour']),
+    'get_top_products': TOP_PRODUCTS_QUERY.format(group=SALES_GROUPS['year_month']),
+    'get_basket_stats': BASKET_QUERY.format(group=SALES_GROUPS['year_month']),
+    'get_price_change_stats': PRICE_CHANGE_QUERY,
+    # последний загруженный заказ пекарни - граница для дозагрузки выгрузок
+    'import_high_water': "SELECT id, date FROM orders WHERE bakery_id=:bakery_id ORDER BY id DESC LIMIT 1",
+    # остатки и цены всей корзины одним запросом; в place_order список IN строится по числу продуктов
+    'place_order_stock': "SELECT s.product_id, s.quantity, p.price FROM stock s JOIN products p ON p.id = s.product_id WHERE s.bakery_id = :bakery_id AND s.product_id IN (:p0)",
+    # версия таблицы для кэша: в режиме журнала row - последняя запись о ней в logs, в summary - число изменений
+    'table_version': "SELECT MAX(id) FROM logs WHERE table_name=:table_name",
+    'table_version_summary': "SELECT SUM(changes) FROM log_summary WHERE table_name=:table_name",
+    # поиски, которые выполняют триггеры order_product_insert, stock_insert и stock_update на каждую строку заказа
+    'trigger_order_line': "SELECT * FROM order_product WHERE order_id=:order_id AND product_id=:product_id",
+    'trigger_stock': "SELECT quantity FROM stock WHERE product_id=:product_id AND bakery_id=(SELECT bakery_id FROM orders WHERE id=:order_id)",
+}
+
+# отметка изменений базы для проверки кэша одним запросом без чтения таблиц: total_changes() - строки, изменённые
+# этим соединением, data_version - меняется, когда запись фиксирует другое соединение (в том числе другой процесс)
+DATA_STAMP_QUERY = "SELECT total_changes(), data_version FROM pragma_data_version"
+
+# столбцы get_sale_lines
+SALE_COLUMNS = ('bakery_id', 'date', 'time', 'order_ID', 'product', 'quantity', 'unit_price')
+
+# журналируемые таблицы и первичный ключ строки в журнале
+LOG_KEYS = {
+    'bakeries': "{row}.id",
+    'products': "{row}.id",
+    'stock': "{row}.bakery_id || ':' || {row}.product_id",
+    'orders': "{row}.id",
+    'order_product': "{row}.order_id || ':' || {row}.product_id",
+    'users': "{row}.id",
+    'roles': "{row}.id",
+}
+
+# режимы журнала: row - строка в logs на каждое изменение, summary - только счётчики изменений
+# по (таблица, операция) в log_summary, off - без журнала
+JOURNAL_MODES = ('row', 'summary', 'off')
+
+# шаг плана без индекса: "SCAN orders" (в старых версиях SQLite - "SCAN TABLE orders")
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+
+def routed(method):
+    # метод данных одной пекарни: в режиме sharded он выполняется в репозитории файла пекарни bakery_id.
+    # Номера заказов в файлах пекарен независимы, поэтому без bakery_id метод в этом режиме не выполняется
+    parameters = inspect.signature(method).parameters
+    position = list(parameters).index('bakery_id') - 1
+    default = parameters['bakery_id'].default
+
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        if self.storage_mode != 'sharded':
+            return method(self, *args, **kwargs)
+        if 'bakery_id' in kwargs:
+            bakery_id = kwargs['bakery_id']
+        else:
+            bakery_id = args[position] if position < len(args) else default
+        if bakery_id is None:
+            raise ValueError('bakery_id is required in sharded storage mode')
+        return getattr(self.shard(bakery_id), method.__name__)(*args, **kwargs)
+    return call
 
-from raw_data import DF
-from traitlets import default
 
 class DBRepo:
-    def __init__(self, con=None) -> None:
+    def __init__(self, con=None, storage_mode: str=STORAGE_MODE) -> None:
         if con:
             self.con = con
         else:
@@ -26,16 +237,150 @@ class DBRepo:
 
         self.con.open()
         self.query = QSqlQuery() if con is None else QSqlQuery(con)
+        self.statements = StatementCache(self.con, repo=self)
+        self._apply_pragmas()
+
+        self.storage_mode = storage_mode
+        self.router = None
+        self.journal_mode = self._read_setting('journal_mode', 'row')
+
+        # версии таблиц, прочитанные при отметке изменений data_stamp; пока отметка та же, журнал не перечитывается
+        self.table_versions = {}
+        self.data_stamp = None
+        # результаты чтений кэшируются; результат из кэша общий, изменять его нельзя
+        self.cache = {
+            'products': LRUCache(256),
+            'order_detail': LRUCache(128),
+            'stock': LRUCache(8),
+        }
+        if PROFILE_QUERIES:
+            self.enable_profiling()
 
     def open(self)-> bool:
         return self.con.open()
 
     def close(self) -> bool:
+        self.statements.clear()
         return self.con.close()
 
+    def release(self) -> str:
+        # закрывает соединение и отпускает все свои ссылки на него, чтобы его можно было удалить через
+        # QSqlDatabase.removeDatabase, даже если на сам репозиторий ещё кто-то ссылается; возвращает имя
+        # соединения. После этого репозиторием пользоваться нельзя
+        name = self.con.connectionName()
+        self.close()
+        self.statements.con = None
+        self.con = None
+        return name
+
     def get_connection(self) -> QSqlDatabase:
         return self.con
 
+    def _apply_pragmas(self, pragmas: dict=SQLITE_PRAGMAS) -> None:
+        for name, value in pragmas.items():
+            self.query.exec(f"PRAGMA {name} = {value}")
+
+    def _prepare(self, sql: str) -> QSqlQuery:
+        # у каждого текста SQL свой подготовленный запрос: он компилируется один раз на соединение,
+        # вызовы с разным SQL не сбивают друг другу привязки и курсор. Запрос, прочитанный не до конца,
+        # нужно закрыть finish(), иначе соединение продолжит держать снимок данных
+        return self.statements.get(sql)
+
+    def enable_profiling(self, profiler=None) -> None:
+        # время, строки и текст каждого вызова и запроса пишутся в профилировщик (по умолчанию общий)
+        from . import profiling
+        profiling.instrument(self, profiler or profiling.profiler)
+
+    def statement_info(self) -> dict:
+        return self.statements.info()
+
+    def shards(self) -> 'ShardRouter':
+        # маршрутизатор файлов пекарен; сам по себе ни один файл не открывает
+        if self.router is None:
+            from .shards import ShardRouter
+            self.router = ShardRouter(self)
+        return self.router
+
+    def shard(self, bakery_id: int) -> 'DBRepo':
+        # репозиторий, в котором лежат заказы и склад пекарни: в режиме sharded - файл пекарни, иначе этот же
+        if self.storage_mode != 'sharded':
+            return self
+        return self.shards().repo_for(bakery_id)
+
+
+    def chain_query(self, sql: str, params: dict=None) -> list:
+        # запрос по всем пекарням: {rows:table} заменяется на саму таблицу, а в режиме sharded - на объединение
+        # этой таблицы из всех файлов пекарен, например "SELECT date, SUM(revenue) FROM {rows:sales_hourly} GROUP BY 1"
+        table = sql[sql.index('{rows:') + len('{rows:'):sql.index('}')]
+        source = table
+        if self.storage_mode == 'sharded':
+            source = self.shards().union(table)
+        query = self._prepare(sql.replace(f'{{rows:{table}}}', source))
+        for name, value in (params or {}).items():
+            query.bindValue(f":{name}", value)
+        if not query.exec():
+            raise RuntimeError(query.lastError().text())
+        rows = []
+        while query.next():
+            rows.append(tuple(query.value(i) for i in range(query.record().count())))
+        return rows
+
+    def _read_setting(self, name: str, default: str=None) -> str:
+        query = self._prepare("SELECT value FROM settings WHERE name=:name")
+        query.bindValue(":name", name)
+        if query.exec() and query.next():
+            value = query.value(0)
+            query.finish()
+            return value
+        return default
+
+    def _write_setting(self, name: str, value: str) -> None:
+        query = self._prepare("INSERT OR REPLACE INTO settings (name, value) VALUES (:name, :value)")
+        query.bindValue(":name", name)
+        query.bindValue(":value", value)
+        query.exec()
+
+    def _table_version(self, tables: tuple) -> tuple:
+        # триггеры журнала срабатывают на каждое изменение, поэтому версия таблицы меняется
+        # при любой записи в неё, в том числе из другого соединения; без журнала версии нет и кэш не используется.
+        # Загрузка без триггеров журнал не пишет, а пересоздание базы его обнуляет, поэтому первым в версии
+        # идёт поколение данных, которое меняет каждая такая загрузка
+        # идёт поколение данных, которое меняет каждая такая загрузка. Сам журнал перечитывается, только
+        # когда сдвинулась отметка изменений базы, поэтому попадание в кэш стоит одного запроса
+        if self.journal_mode == 'off':
+            return None
+        query = self._prepare(DATA_STAMP_QUERY)
+        query.exec()
+        query.next()
+        stamp = (query.value(0), query.value(1))
+        query.finish()
+        if stamp != self.data_stamp:
+            self.table_versions.clear()
+            self.data_stamp = stamp
+        version = self.table_versions.get(tables)
+        if version is not None:
+            return version
+        sql = HOT_QUERIES['table_version' if self.journal_mode == 'row' else 'table_version_summary']
+        version = [self._read_setting('data_generation')]
+        for table in tables:
+            query = self._prepare(sql)
+            query.bindValue(":table_name", table)
+            query.exec()
+            query.next()
+            version.append(query.value(0))
+            query.finish()
+        version = tuple(version)
+        self.table_versions[tables] = version
+        return version
+
+    def cache_info(self) -> dict:
+        return {name: cache.info() for name, cache in self.cache.items()}
+
+    def clear_cache(self) -> None:
+        self.table_versions.clear()
+        for cache in self.cache.values():
+            cache.clear()
+
     def create_tables(self) -> None:
         self.query.exec(
             """--sql
@@ -63,6 +408,7 @@ class DBRepo:
                 bakery_id INTEGER NOT NULL,
                 product_id INTEGER NOT NULL,
                 quantity INTEGER,
+                version INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (bakery_id) REFERENCES bakeries (id) ON UPDATE CASCADE ON DELETE CASCADE,
                 FOREIGN KEY (product_id) REFERENCES products (id) ON UPDATE CASCADE ON DELETE NO ACTION,
                 PRIMARY KEY (bakery_id, product_id)
@@ -104,7 +450,7 @@ class DBRepo:
                 role_id INTEGER,
                 name VARCHAR(40) NOT NULL,
                 login VARCHAR(16) NOT NULL UNIQUE,
-                password VARCHAR(20) NOT NULL,
+                password VARCHAR(255) NOT NULL,
                 FOREIGN KEY (bakery_id) REFERENCES bakeries (id) ON UPDATE CASCADE ON DELETE SET NULL,
                 FOREIGN KEY (role_id) REFERENCES roles (id) ON UPDATE CASCADE ON DELETE SET NULL
             )
@@ -126,7 +472,44 @@ class DBRepo:
                 id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
                 change_date TIMESTAMP NOT NULL,
                 op_type VARCHAR(20) NOT NULL,
-                table_name VARCHAR(20) NOT NULL
+                table_name VARCHAR(20) NOT NULL,
+                row_key VARCHAR(40)
+            )
+            """
+        )
+
+        self.query.exec(
+            """--sql
+            CREATE TABLE IF NOT EXISTS log_summary (
+                table_name VARCHAR(20) NOT NULL,
+                op_type VARCHAR(20) NOT NULL,
+                changes INTEGER NOT NULL,
+                last_change TIMESTAMP NOT NULL, -- julianday, читать через datetime(last_change)
+                PRIMARY KEY (table_name, op_type)
+            )
+            """
+        )
+
+        self.query.exec( # продажи по часам: строки заказов, количество и выручка в центах, ведётся триггерами sales_*
+            """--sql
+            CREATE TABLE IF NOT EXISTS sales_hourly (
+                bakery_id INTEGER NOT NULL,
+                date DATE NOT NULL,
+                hour INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                lines INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                revenue INTEGER NOT NULL,
+                PRIMARY KEY (bakery_id, date, hour, product_id)
+            )
+            """
+        )
+
+        self.query.exec(
+            """--sql
+            CREATE TABLE IF NOT EXISTS settings (
+                name VARCHAR(40) PRIMARY KEY NOT NULL,
+                value VARCHAR(100)
             )
             """
         )
@@ -141,23 +524,101 @@ class DBRepo:
         self.query.exec("DROP TABLE IF EXISTS users")
         self.query.exec("DROP TABLE IF EXISTS roles")
         self.query.exec("DROP TABLE IF EXISTS logs")
+        self.query.exec("DROP TABLE IF EXISTS log_summary")
+        self.query.exec("DROP TABLE IF EXISTS settings")
+        self.query.exec("DROP TABLE IF EXISTS sales_hourly")
+        # подготовленные запросы ссылаются на удалённые таблицы и после пересоздания схемы не выполняются
+        self.statements.clear()
         print('Tables dropped')
 
-    def _add_log_triggers(self) -> None:
-        tables = ['bakeries', 'products', 'stock', 'orders', 'order_product', 'users', 'roles']
-        for table in tables:
+    def create_indexes(self) -> None:
+        for name, table, columns, unique in INDEXES:
+            self.query.exec(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+        print('Indexes created')
+
+    def drop_indexes(self) -> None:
+        for name, *_ in INDEXES:
+            self.query.exec(f"DROP INDEX IF EXISTS {name}")
+        print('Indexes dropped')
+
+    def explain(self, sql: str) -> list:
+        # план запроса; все параметры подставляются заглушкой, на выбор индексов это не влияет
+        query = self._prepare("EXPLAIN QUERY PLAN " + sql)
+        for name in set(re.findall(r':(\w+)', sql)):
+            query.bindValue(f":{name}", 1)
+        query.exec()
+        plan = []
+        while query.next():
+            plan.append(query.value(3))
+        return plan
+
+    def check_query_plans(self) -> dict:
+        # {имя запроса: шаги плана с полным просмотром таблицы}, пустой словарь - всё в порядке
+        offenders = {}
+        for name, sql in HOT_QUERIES.items():
+            scans = [step for step in self.explain(sql) if FULL_SCAN.match(step)]
+            if scans:
+                offenders[name] = scans
+        return offenders
+
+    def _add_log_triggers(self, mode: str=JOURNAL_MODE) -> None:
+        self.set_journal_mode(mode)
+        print('Log triggers added')
+
+    def set_journal_mode(self, mode: str) -> None:
+        if mode not in JOURNAL_MODES:
+            raise ValueError(f'Unknown journal mode: {mode}')
+        for table, key in LOG_KEYS.items():
             for op in ['INSERT', 'UPDATE', 'DELETE']:
+                self.query.exec(f"DROP TRIGGER IF EXISTS {table}_{op.lower()}_log")
+                if mode == 'row':
+                    row_key = key.format(row='OLD' if op == 'DELETE' else 'NEW')
+                    body = f"""INSERT INTO logs (change_date, op_type, table_name, row_key)
+                        VALUES (datetime('now'), '{op}', '{table}', {row_key});"""
+                elif mode == 'summary':
+                    # строка счётчика создаётся заранее, триггеру остаётся только обновить её. Триггеры SQLite
+                    # бывают только FOR EACH ROW, а момента фиксации транзакции SQL не видит, поэтому счётчик
+                    # не копится до конца оператора, а обновляется на каждой строке; время хранится числом
+                    # julianday - форматирование datetime('now') на каждой строке стоило заметную долю записи
+                    self.query.exec(f"INSERT OR IGNORE INTO log_summary (table_name, op_type, changes, last_change) VALUES ('{table}', '{op}', 0, julianday('now'))")
+                    body = f"""UPDATE log_summary SET changes = changes + 1, last_change = julianday('now')
+                        WHERE table_name = '{table}' AND op_type = '{op}';"""
+                else:
+                    continue
                 self.query.exec(
                     f"""--sql
                     CREATE TRIGGER IF NOT EXISTS {table}_{op.lower()}_log
                     AFTER {op} ON {table}
                     BEGIN
-                        INSERT INTO logs (change_date, op_type, table_name)
-                        VALUES (datetime('now'), '{op}', '{table}');
+                        {body}
                     END
                     """
                 )
-        print('Log triggers added')
+        self._write_setting('journal_mode', mode)
+        self.journal_mode = mode
+        self.clear_cache()
+
+    def prune_logs(self, max_rows: int=LOG_MAX_ROWS, max_age_days: int=LOG_MAX_AGE_DAYS) -> int:
+        # оставляет в logs не больше max_rows последних записей и не старше max_age_days дней
+        deleted = 0
+        if max_rows is not None:
+            query = self._prepare("DELETE FROM logs WHERE id <= (SELECT MAX(id) FROM logs) - :max_rows")
+            query.bindValue(":max_rows", max_rows)
+            query.exec()
+            deleted += query.numRowsAffected()
+        if max_age_days is not None:
+            # logs пишется по возрастанию id и даты, поэтому граница - первая достаточно свежая запись
+            query = self._prepare("""--sql
+                DELETE FROM logs WHERE id < COALESCE(
+                    (SELECT id FROM logs WHERE change_date >= datetime('now', :age) ORDER BY id LIMIT 1),
+                    (SELECT MAX(id) + 1 FROM logs)
+                )
+                """)
+            query.bindValue(":age", f'-{max_age_days} days')
+            query.exec()
+            deleted += query.numRowsAffected()
+        return deleted
+
 
     def add_triggers(self) -> None:
 
@@ -180,13 +641,12 @@ class DBRepo:
 
 
         self.query.exec( # Проверка на наличие продукта на складе
-            """--sql
-            CREATE TRIGGER stock_update
+            f"""--sql
+            CREATE TRIGGER IF NOT EXISTS stock_update
             BEFORE UPDATE ON order_product
             BEGIN
-                UPDATE stock
-                SET quantity =
-                CASE WHEN (
+                SELECT RAISE(ABORT, 'Not enough products in stock')
+                WHERE COALESCE((
                     SELECT quantity
                     FROM stock
                     WHERE product_id = NEW.product_id
@@ -195,29 +655,26 @@ class DBRepo:
                         FROM orders
                         WHERE id = NEW.order_id
                     )
-                )>= NEW.quantity THEN
-                    quantity + OLD.quantity - NEW.quantity
-                    WHERE product_id = NEW.product_id
-                    AND bakery_id = ( SELECT bakery_id FROM orders WHERE id = NEW.order_id );
-                ELSE
-                    RAISE(ABORT, "Not enough products in stock")
-                END;
+                ), 0) + OLD.quantity < NEW.quantity;
+                UPDATE stock
+                SET quantity = quantity + OLD.quantity - NEW.quantity, {STOCK_VERSION}
+                WHERE product_id = NEW.product_id
+                AND bakery_id = ( SELECT bakery_id FROM orders WHERE id = NEW.order_id );
             END;
             """
         )
 
         self.query.exec(
-            """--sql
-            CREATE TRIGGER stock_insert
+            f"""--sql
+            CREATE TRIGGER IF NOT EXISTS stock_insert
             BEFORE INSERT ON order_product
             WHEN NOT EXISTS (
                 SELECT * FROM order_product
                 WHERE order_id = NEW.order_id AND product_id = NEW.product_id
             )
             BEGIN
-                UPDATE stock
-                SET quantity =
-                CASE WHEN (
+                SELECT RAISE(ABORT, 'Not enough products in stock')
+                WHERE COALESCE((
                     SELECT quantity
                     FROM stock
                     WHERE product_id = NEW.product_id
@@ -226,30 +683,67 @@ class DBRepo:
                         FROM orders
                         WHERE id = NEW.order_id
                     )
-                )>= NEW.quantity THEN
-                    quantity - NEW.quantity
-                    WHERE product_id = NEW.product_id
-                    AND bakery_id = (SELECT bakery_id FROM orders WHERE id = NEW.order_id);
-                ELSE
-                    RAISE(ABORT, "Not enough products in stock")
-                END;
+                ), 0) < NEW.quantity;
+                UPDATE stock
+                SET quantity = quantity - NEW.quantity, {STOCK_VERSION}
+                WHERE product_id = NEW.product_id
+                AND bakery_id = (SELECT bakery_id FROM orders WHERE id = NEW.order_id);
             END;
             """
         )
 
         self.query.exec(
-            """--sql
+            f"""--sql
             CREATE TRIGGER stock_delete
             AFTER DELETE ON order_product
             BEGIN
                 UPDATE stock
-                SET quantity = quantity + OLD.quantity
+                SET quantity = quantity + OLD.quantity, {STOCK_VERSION}
                 WHERE product_id = OLD.product_id
                 AND bakery_id = ( SELECT bakery_id FROM orders WHERE id = OLD.order_id );
             END
             """
         )
 
+        # продажи по часам: строка заказа добавляет в sales_hourly свою долю, удаление её вычитает,
+        # изменение - вычитает старую и добавляет новую
+        for name, op, parts in [
+            ('sales_insert', 'INSERT', [('NEW', 1)]),
+            ('sales_delete', 'DELETE', [('OLD', -1)]),
+            ('sales_update', 'UPDATE', [('OLD', -1), ('NEW', 1)]),
+        ]:
+            body = ''.join(SALES_UPSERT.format(row=row, sign=sign) for row, sign in parts)
+            self.query.exec(
+                f"""--sql
+                CREATE TRIGGER IF NOT EXISTS {name}
+                AFTER {op} ON order_product
+                BEGIN
+                    {body}
+                END
+                """
+            )
+
+        # выручка считается по текущей цене продукта, поэтому при смене цены продажи продукта пересчитываются
+        # целиком, иначе удаление строки после смены цены вычло бы не ту сумму, что была добавлена.
+        # Перенос и удаление заказа переносят или вычитают доли всех его строк (внешние ключи выключены,
+        # каскада нет: оставшиеся без заказа строки в sales_hourly уже не попадают)
+        for name, event, body in [
+            ('sales_price_update', 'UPDATE OF price ON products WHEN OLD.price IS NOT NEW.price',
+             "DELETE FROM sales_hourly WHERE product_id = NEW.id;" + SALES_REBUILD.format(condition='op.product_id = NEW.id')),
+            ('sales_order_update', 'UPDATE OF bakery_id, date, time ON orders',
+             ''.join(ORDER_SALES_UPSERT.format(row=row, sign=sign) for row, sign in [('OLD', -1), ('NEW', 1)])),
+            ('sales_order_delete', 'DELETE ON orders', ORDER_SALES_UPSERT.format(row='OLD', sign=-1)),
+        ]:
+            self.query.exec(
+                f"""--sql
+                CREATE TRIGGER IF NOT EXISTS {name}
+                AFTER {event}
+                BEGIN
+                    {body}
+                END
+                """
+            )
+
         # триггер после обновления склада, который удаляет запись о продукте со склада, если его количество равно 0
         # self.query.exec(
         #     """--sql
@@ -265,146 +759,607 @@ class DBRepo:
         print('Triggers added')
 
     def add_bakery(self, name: str, addr: str) -> None:
-        self.query.prepare("INSERT INTO bakeries (name, address) VALUES (:name, :addr)")
-        self.query.bindValue(":name", name)
-        self.query.bindValue(":addr", addr)
-        self.query.exec()
+        query = self._prepare("INSERT INTO bakeries (name, address) VALUES (:name, :addr)")
+        query.bindValue(":name", name)
+        query.bindValue(":addr", addr)
+        query.exec()
 
     def add_role(self, name: str) -> None:
-        self.query.prepare("INSERT INTO roles (name) VALUES (:name)")
-        self.query.bindValue(":name", name)
-        self.query.exec()
+        query = self._prepare("INSERT INTO roles (name) VALUES (:name)")
+        query.bindValue(":name", name)
+        query.exec()
 
     def add_user(self, bakery_id: int, role_id: int, name: str, login: str, password: str) -> None:
-        self.query.prepare("INSERT INTO users (bakery_id, role_id, name, login, password) VALUES (:bakery_id, :role_id, :name, :login, :password)")
-        self.query.bindValue(":bakery_id", bakery_id)
-        self.query.bindValue(":role_id", role_id)
-        self.query.bindValue(":name", name)
-        self.query.bindValue(":login", login)
-        self.query.bindValue(":password", str(hash(password)))
-        self.query.exec()
+        query = self._prepare("INSERT INTO users (bakery_id, role_id, name, login, password) VALUES (:bakery_id, :role_id, :name, :login, :password)")
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":role_id", role_id)
+        query.bindValue(":name", name)
+        query.bindValue(":login", login)
+        query.bindValue(":password", hash_password(password))
+        query.exec()
+
+    def set_password(self, user_id: int, password: str) -> None:
+        query = self._prepare("UPDATE users SET password=:password WHERE id=:id")
+        query.bindValue(":password", hash_password(password))
+        query.bindValue(":id", user_id)
+        query.exec()
+
+    def get_user(self, login: str) -> User:
+        # пользователь с хэшем пароля или None; проверка пароля - в db.auth.Auth
+        query = self._prepare(HOT_QUERIES['get_user'])
+        query.bindValue(":login", login)
+        query.exec()
+        user = User(*(query.value(i) for i in range(6))) if query.next() else None
+        query.finish()
+        return user
 
     def add_product(self, name: str, price: Decimal, id: int=None) -> int:
         if id is None:
-            self.query.prepare("INSERT INTO products (name, price) VALUES (:name, :price)")
-            self.query.bindValue(":name", name)
-            self.query.bindValue(":price", price)
-            self.query.exec()
-            id = self.query.lastInsertId()
+            query = self._prepare("INSERT INTO products (name, price) VALUES (:name, :price)")
+            query.bindValue(":name", name)
+            query.bindValue(":price", price)
+            query.exec()
+            id = query.lastInsertId()
         else:
-            self.query.prepare("INSERT INTO products (id, name, price) VALUES (:id, :name, :price)")
-            self.query.bindValue(":id", id)
-            self.query.bindValue(":name", name)
-            self.query.bindValue(":price", price)
-            self.query.exec()
+            query = self._prepare("INSERT INTO products (id, name, price) VALUES (:id, :name, :price)")
+            query.bindValue(":id", id)
+            query.bindValue(":name", name)
+            query.bindValue(":price", price)
+            query.exec()
         return id
 
+    @routed
     def add_order(self, bakery_id: int, date: str=None, time: str=None, id: int=None) -> int:
         if date is None:
-            date = datetime.now().strftime('%Y-%m-%d')
+            date = datetime.datetime.now().strftime('%Y-%m-%d')
         if time is None:
-            time = datetime.now().strftime('%H:%M')
+            time = datetime.datetime.now().strftime('%H:%M')
         if id is None:
-            self.query.prepare("INSERT INTO orders (bakery_id, date, time) VALUES (:bakery_id, :date, :time)")
-            self.query.bindValue(":bakery_id", bakery_id)
-            self.query.bindValue(":date", date)
-            self.query.bindValue(":time", time)
-            self.query.exec()
-            id = self.query.lastInsertId()
+            query = self._prepare("INSERT INTO orders (bakery_id, date, time) VALUES (:bakery_id, :date, :time)")
+            query.bindValue(":bakery_id", bakery_id)
+            query.bindValue(":date", date)
+            query.bindValue(":time", time)
+            query.exec()
+            id = query.lastInsertId()
         else:
-            self.query.prepare("INSERT INTO orders (id, bakery_id, date, time) VALUES (:id, :bakery_id, :date, :time)")
-            self.query.bindValue(":id", id)
-            self.query.bindValue(":bakery_id", bakery_id)
-            self.query.bindValue(":date", date)
-            self.query.bindValue(":time", time)
-            self.query.exec()
+            query = self._prepare("INSERT INTO orders (id, bakery_id, date, time) VALUES (:id, :bakery_id, :date, :time)")
+            query.bindValue(":id", id)
+            query.bindValue(":bakery_id", bakery_id)
+            query.bindValue(":date", date)
+            query.bindValue(":time", time)
+            query.exec()
         return id
 
-    def add_order_product(self, order_id: int, product_id: int, quantity: int, price_change: int=None) -> None:
+    @routed
+    def add_order_product(self, order_id: int, product_id: int, quantity: int, price_change: int=None, bakery_id: int=None) -> bool:
+        # False - строка не записана (например, триггер склада её отклонил); bakery_id нужен только в режиме sharded
         if price_change is None:
-            self.query.prepare("INSERT INTO order_product (order_id, product_id, quantity) VALUES (:order_id, :product_id, :quantity)")
-            self.query.bindValue(":order_id", order_id)
-            self.query.bindValue(":product_id", product_id)
-            self.query.bindValue(":quantity", quantity)
-            self.query.exec()
-        else:
-            self.query.prepare("INSERT INTO order_product (order_id, product_id, quantity, price_change) VALUES (:order_id, :product_id, :quantity, :price_change)")
-            self.query.bindValue(":order_id", order_id)
-            self.query.bindValue(":product_id", product_id)
-            self.query.bindValue(":quantity", quantity)
-            self.query.bindValue(":price_change", price_change)
-            self.query.exec()
+            query = self._prepare("INSERT INTO order_product (order_id, product_id, quantity) VALUES (:order_id, :product_id, :quantity)")
+            query.bindValue(":order_id", order_id)
+            query.bindValue(":product_id", product_id)
+            query.bindValue(":quantity", quantity)
+            return query.exec()
+        query = self._prepare("INSERT INTO order_product (order_id, product_id, quantity, price_change) VALUES (:order_id, :product_id, :quantity, :price_change)")
+        query.bindValue(":order_id", order_id)
+        query.bindValue(":product_id", product_id)
+        query.bindValue(":quantity", quantity)
+        query.bindValue(":price_change", price_change)
+        return query.exec()
+
+    @routed
+    def place_order(self, bakery_id: int, lines: list, date: str=None, time: str=None) -> tuple:
+        # lines = [(product_id, quantity) или (product_id, quantity, price_change), ...]
+        # заказ и все строки пишутся одной транзакцией; возвращает (order_id, сумма в Decimal)
+        basket = {}
+        for product_id, quantity, *price_change in lines:
+            if product_id in basket:
+                basket[product_id][0] += quantity
+            else:
+                basket[product_id] = [quantity, price_change[0] if price_change else None]
+        if not basket:
+            raise ValueError('Order has no lines')
+
+        # остатки проверяются для всей корзины сразу, до записи
+        placeholders = ', '.join(f':p{i}' for i in range(len(basket)))
+        query = self._prepare(HOT_QUERIES['place_order_stock'].replace('(:p0)', f'({placeholders})'))
+        query.bindValue(":bakery_id", bakery_id)
+        for i, product_id in enumerate(basket):
+            query.bindValue(f":p{i}", product_id)
+        query.exec()
+        available = {}
+        while query.next():
+            available[query.value(0)] = (query.value(1), query.value(2))
+        missing = [product_id for product_id, (quantity, _) in basket.items() if available.get(product_id, (0, None))[0] < quantity]
+        if missing:
+            raise ValueError(f'Not enough products in stock: {missing}')
+
+        if date is None:
+            date = datetime.datetime.now().strftime('%Y-%m-%d')
+        if time is None:
+            time = datetime.datetime.now().strftime('%H:%M')
+        # если транзакцию уже открыл вызывающий код, фиксирует её тоже он
+        own_transaction = self.con.transaction()
+        try:
+            query = self._prepare("INSERT INTO orders (bakery_id, date, time) VALUES (:bakery_id, :date, :time)")
+            query.bindValue(":bakery_id", bakery_id)
+            query.bindValue(":date", date)
+            query.bindValue(":time", time)
+            if not query.exec():
+                raise RuntimeError(query.lastError().text())
+            order_id = query.lastInsertId()
+            self._exec_batch(
+                "INSERT INTO order_product (order_id, product_id, quantity, price_change) VALUES (?, ?, ?, ?)",
+                (
+                    [order_id] * len(basket),
+                    list(basket),
+                    [quantity for quantity, _ in basket.values()],
+                    [price_change for _, price_change in basket.values()],
+                ),
+            )
+        except RuntimeError:
+            if own_transaction:
+                self.con.rollback()
+            raise
+        if own_transaction:
+            self.con.commit()
+
+        total_cents = 0
+        for product_id, (quantity, price_change) in basket.items():
+            # как LINE_PRICE: нулевая price_change - цена по умолчанию
+            price = price_change if price_change else available[product_id][1]
+            total_cents += round(price * 100) * quantity
+        return order_id, Decimal(total_cents).scaleb(-2)
 
+    @routed
     def add_stock(self, product_id: int, quantity: int, bakery_id: int=1) -> None:
-        self.query.prepare("INSERT INTO stock (bakery_id, product_id, quantity) VALUES (:bakery_id, :product_id, :quantity)")
-        self.query.bindValue(":bakery_id", bakery_id)
-        self.query.bindValue(":product_id", product_id)
-        self.query.bindValue(":quantity", quantity)
-        self.query.exec()
+        query = self._prepare(
+            """--sql
+            INSERT INTO stock (bakery_id, product_id, quantity, version)
+            SELECT :bakery_id, :product_id, :quantity, COALESCE(MAX(version), 0) + 1 FROM stock WHERE bakery_id = :bakery_id
+            """
+        )
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":product_id", product_id)
+        query.bindValue(":quantity", quantity)
+        query.exec()
 
+    @routed
     def set_stock(self, product_id: int, quantity: int, bakery_id: int=1) -> None:
-        self.query.prepare("UPDATE stock SET quantity=:quantity WHERE bakery_id=:bakery_id AND product_id=:product_id")
-        self.query.bindValue(":bakery_id", bakery_id)
-        self.query.bindValue(":product_id", product_id)
-        self.query.bindValue(":quantity", quantity)
-        self.query.exec()
+        query = self._prepare(f"UPDATE stock SET quantity=:quantity, {STOCK_VERSION} WHERE bakery_id=:bakery_id AND product_id=:product_id")
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":product_id", product_id)
+        query.bindValue(":quantity", quantity)
+        query.exec()
 
     def get_product(self, name: str) -> dict:
-        self.query.prepare("SELECT * FROM products WHERE name=:name")
-        self.query.bindValue(":name", name)
-        self.query.exec()
-        self.query.next()
-        return {'id': self.query.value(0), 'name': self.query.value(1), 'price': self.query.value(2)}
+        version = self._table_version(('products',))
+        product = self.cache['products'].get(name, version)
+        if product is not LRUCache.missing:
+            return product
+        query = self._prepare(HOT_QUERIES['get_product'])
+        query.bindValue(":name", name)
+        query.exec()
+        query.next()
+        product = {'id': query.value(0), 'name': query.value(1), 'price': query.value(2)}
+        query.finish()
+        self.cache['products'].put(name, version, product)
+        return product
 
     # МБ НЕ РАБОТАЕТ def get_order_id(self, bakery_id: int, date: str, time: str) -> dict:
-    #     self.query.prepare("SELECT * FROM orders WHERE bakery_id=:bakery_id AND date=:date AND time=:time")
-    #     self.query.bindValue(":bakery_id", bakery_id)
-    #     self.query.bindValue(":date", date)
-    #     self.query.bindValue(":time", time)
-    #     self.query.exec()
-    #     self.query.next()
-    #     return {'id': self.query.value(0), 'bakery_id': self.query.value(1), 'date': self.query.value(2), 'time': self.query.value(3)}
-
-    def get_orders(self, bakery_id=1) -> list:
-        self.query.prepare("SELECT * FROM orders WHERE bakery_id=:bakery_id")
-        self.query.bindValue(":bakery_id", bakery_id)
-        self.query.exec()
-        orders = {}
-        while self.query.next():
-            orders[self.query.value(0)] = {'id': self.query.value(0), 'bakery_id': self.query.value(1), 'date': self.query.value(2), 'time': self.query.value(3)}
-        return orders
-
-    def get_order(self, order_id: int) -> dict:
-        self.query.prepare("SELECT (SELECT name FROM products WHERE id=product_id), quantity, (SELECT price FROM products WHERE id=product_id), price_change FROM order_product WHERE order_id=:order_id")
-        self.query.bindValue(":order_id", order_id)
-        self.query.exec()
+    #     query = self._prepare("SELECT * FROM orders WHERE bakery_id=:bakery_id AND date=:date AND time=:time")
+    #     query.bindValue(":bakery_id", bakery_id)
+    #     query.bindValue(":date", date)
+    #     query.bindValue(":time", time)
+    #     query.exec()
+    #     query.next()
+    #     return {'id': query.value(0), 'bakery_id': query.value(1), 'date': query.value(2), 'time': query.value(3)}
+
+    def get_orders(self, bakery_id=1) -> dict:
+        # {id: Order}
+        return {order.id: order for order in self.iter_orders(bakery_id)}
+
+    @routed
+    def iter_orders(self, bakery_id: int=1):
+        # заказы пекарни по одному, без сборки всего словаря. Пока итерация не закончена,
+        # запрос занят: повторный get_orders/iter_orders на том же репозитории её прервёт
+        query = self._prepare(HOT_QUERIES['get_orders'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.exec()
+        # дат и времён немного, одинаковые строки хранятся один раз
+        intern = sys.intern
+        try:
+            while query.next():
+                yield Order(query.value(0), query.value(1), intern(query.value(2)), intern(query.value(3)))
+        finally:
+            query.finish()
+
+    @routed
+    def get_orders_page(self, bakery_id: int=1, after_id: int=0, limit: int=500) -> list:
+        # keyset-пагинация: страница начинается сразу после последнего показанного id
+        query = self._prepare(HOT_QUERIES['get_orders_page'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":after_id", after_id)
+        query.bindValue(":limit", limit)
+        query.exec()
+        page = []
+        while query.next():
+            page.append((query.value(0), query.value(1), query.value(2)))
+        return page
+
+    @routed
+    def get_order(self, order_id: int, bakery_id: int=None) -> dict:
+        query = self._prepare(HOT_QUERIES['get_order'])
+        query.bindValue(":order_id", order_id)
+        query.exec()
+        # {название: OrderLine}
         order = {}
-        while self.query.next():
-            price = self.query.value(3) if self.query.value(3) else self.query.value(2)
-            order[self.query.value(0)] = {'name': self.query.value(0), 'quantity': self.query.value(1), 'price': price}
+        while query.next():
+            price = query.value(3) if query.value(3) else query.value(2)
+            order[query.value(0)] = OrderLine(query.value(0), query.value(1), price)
         return order
 
-    def get_order_price(self, order_id: int) -> int:
-        self.query.prepare("SELECT (SELECT price FROM products WHERE id=product_id), quantity, price_change FROM order_product WHERE order_id=:order_id")
-        self.query.bindValue(":order_id", order_id)
-        self.query.exec()
-        order_price = 0
-        while self.query.next():
-            price = self.query.value(2) if self.query.value(2) else self.query.value(0)
-            order_price += price * self.query.value(1)
-        return order_price
+    @routed
+    def get_order_price(self, order_id: int, bakery_id: int=None) -> int:
+        query = self._prepare(HOT_QUERIES['get_order_price'])
+        query.bindValue(":order_id", order_id)
+        query.exec()
+        order_price = query.value(0) if query.next() else None
+        query.finish()
+        return order_price or 0
 
+    @routed
+    def get_order_detail(self, order_id: int, bakery_id: int=None) -> tuple:
+        # ([(name, quantity, price), ...], total) - строки заказа и его сумма в Decimal;
+        # bakery_id нужен только в режиме sharded, чтобы найти файл пекарни
+        version = self._table_version(('order_product', 'products'))
+        detail = self.cache['order_detail'].get(order_id, version)
+        if detail is not LRUCache.missing:
+            return detail
+        query = self._prepare(HOT_QUERIES['get_order_detail'])
+        query.bindValue(":order_id", order_id)
+        query.exec()
+        lines = []
+        total_cents = 0
+        while query.next():
+            lines.append((query.value(0), query.value(1), query.value(2)))
+            total_cents = query.value(3)
+        detail = (lines, Decimal(total_cents).scaleb(-2))
+        self.cache['order_detail'].put(order_id, version, detail)
+        return detail
+
+    @routed
     def get_stock(self, bakery_id=1) -> dict:
-        # select product id, product name, quantity from stock
-        self.query.prepare("SELECT product_id, (SELECT name FROM products WHERE id=product_id), quantity FROM stock WHERE bakery_id=:bakery_id")
-        self.query.bindValue(":bakery_id", bakery_id)
-        self.query.exec()
+        # {id продукта: StockItem}
+        version = self._table_version(('stock', 'products'))
+        stock = self.cache['stock'].get(bakery_id, version)
+        if stock is not LRUCache.missing:
+            return stock
+        query = self._prepare(HOT_QUERIES['get_stock'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.exec()
         stock = {}
-        while self.query.next():
-            stock[self.query.value(0)] = {'id': self.query.value(0), 'name': self.query.value(1), 'quantity': self.query.value(2)}
+        while query.next():
+            stock[query.value(0)] = StockItem(query.value(0), query.value(1), query.value(2))
+        self.cache['stock'].put(bakery_id, version, stock)
         return stock
 
-    def __insert_data(self) -> None:
+    @routed
+    def get_stock_snapshot(self, bakery_id: int=1) -> tuple:
+        # (версия склада, [StockItem, ...]) для StockModel
+        # версия читается раньше строк: изменение между двумя запросами придёт ещё раз в get_stock_changes
+        version = self._stock_version(bakery_id)
+        stock = self.get_stock(bakery_id)
+        return version, list(stock.values())
+
+    @routed
+    def get_stock_changes(self, bakery_id: int=1, since: int=0) -> tuple:
+        # (новая версия склада, {id продукта: количество}) - только остатки, изменившиеся после версии since
+        query = self._prepare(HOT_QUERIES['get_stock_changes'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":since", since)
+        query.exec()
+        changes = {}
+        version = since
+        while query.next():
+            changes[query.value(0)] = query.value(1)
+            version = max(version, query.value(2))
+        return version, changes
+
+    def _stock_version(self, bakery_id: int) -> int:
+        query = self._prepare(HOT_QUERIES['stock_version'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.exec()
+        version = query.value(0) if query.next() else None
+        query.finish()
+        return version or 0
+
+    @routed
+    def get_sales(self, by: str='hour', bakery_id: int=1, date_from: str='0000-00-00', date_to: str='9999-12-31') -> list:
+        # [(ключ группы, строк заказов, количество, выручка Decimal), ...] из sales_hourly, без чтения order_product
+        if by not in SALES_GROUPS:
+            raise ValueError(f'Unknown sales grouping: {by}')
+        query = self._prepare(SALES_QUERY.format(group=SALES_GROUPS[by]))
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":date_from", date_from)
+        query.bindValue(":date_to", date_to)
+        query.exec()
+        sales = []
+        while query.next():
+            sales.append((query.value(0), query.value(1), query.value(2), Decimal(query.value(3)).scaleb(-2)))
+        return sales
+
+    def _report(self, sql: str, bakery_id: int, date_from: str, date_to: str, params: dict=None) -> list:
+        query = self._prepare(sql)
+        query.bindValue(":bakery_id", bakery_id)
+        query.bindValue(":date_from", date_from)
+        query.bindValue(":date_to", date_to)
+        for name, value in (params or {}).items():
+            query.bindValue(f":{name}", value)
+        if not query.exec():
+            raise RuntimeError(query.lastError().text())
+        rows = []
+        while query.next():
+            rows.append(tuple(query.value(i) for i in range(query.record().count())))
+        return rows
+
+    @routed
+    def get_top_products(self, top: int=5, by: str='year_month', bakery_id: int=1, date_from: str='0000-00-00', date_to: str='9999-12-31') -> list:
+        # [(период, место, продукт, количество, выручка Decimal), ...] - top продуктов по количеству в каждом периоде
+        if by not in SALES_GROUPS or by == 'product':
+            raise ValueError(f'Unknown period: {by}')
+        rows = self._report(TOP_PRODUCTS_QUERY.format(group=SALES_GROUPS[by]), bakery_id, date_from, date_to, {'top': top})
+        return [(period, rank, name, quantity, Decimal(revenue).scaleb(-2)) for period, rank, name, quantity, revenue in rows]
+
+    @routed
+    def get_basket_stats(self, by: str='year_month', bakery_id: int=1, date_from: str='0000-00-00', date_to: str='9999-12-31') -> list:
+        # [(период, заказов, строк в среднем, штук в среднем, средний чек Decimal), ...]
+        if by not in SALES_GROUPS or by == 'product':
+            raise ValueError(f'Unknown period: {by}')
+        rows = self._report(BASKET_QUERY.format(group=SALES_GROUPS[by]), bakery_id, date_from, date_to)
+        cent = Decimal('0.01')
+        return [(period, orders, lines, quantity, Decimal(revenue).scaleb(-2).quantize(cent))
+                for period, orders, lines, quantity, revenue in rows]
+
+    @routed
+    def get_price_change_stats(self, bakery_id: int=1, date_from: str='0000-00-00', date_to: str='9999-12-31') -> list:
+        # [(продукт, цена по умолчанию, строк, строк с другой ценой, их доля, средняя другая цена), ...],
+        # сначала продукты, у которых цена меняется чаще
+        rows = self._report(PRICE_CHANGE_QUERY, bakery_id, date_from, date_to)
+        return [(name, price, lines, changed, changed / lines, average) for name, price, lines, changed, average in rows]
+
+    def get_sale_lines(self, bakery_id: int=None) -> dict:
+        # строки продаж столбцами, как в Bakery_sales.csv, плюс bakery_id; bakery_id=None - вся сеть
+        if bakery_id is None and self.storage_mode == 'sharded':
+            parts = [self.get_sale_lines(bakery_id) for bakery_id in self.shards().bakery_ids()]
+            return {name: [value for part in parts for value in part[name]] for name in SALE_COLUMNS}
+        if bakery_id is not None:
+            shard = self.shard(bakery_id)
+            if shard is not self:
+                return shard.get_sale_lines(bakery_id)
+        query = self._prepare(
+            f"""--sql
+            SELECT o.bakery_id, o.date, o.time, o.id, p.name, op.quantity, {LINE_PRICE.format(line='op')}
+            FROM orders o JOIN order_product op ON op.order_id = o.id JOIN products p ON p.id = op.product_id
+            {'' if bakery_id is None else 'WHERE o.bakery_id = :bakery_id'}
+            ORDER BY o.id
+            """
+        )
+        if bakery_id is not None:
+            query.bindValue(":bakery_id", bakery_id)
+        query.exec()
+        columns = tuple([] for _ in SALE_COLUMNS)
+        while query.next():
+            for i, column in enumerate(columns):
+                column.append(query.value(i))
+        return dict(zip(SALE_COLUMNS, columns))
+
+    def sales_version(self) -> tuple:
+        # версия данных о продажах для кэшей аналитики; None - версию узнать нельзя и кэшировать нельзя
+        # (журнал выключен или заказы лежат в файлах пекарен, изменения которых основная БД не видит)
+        if self.storage_mode == 'sharded':
+            return None
+        return self._table_version(('orders', 'order_product', 'products'))
+
+    def rebuild_sales_summary(self) -> None:
+        # пересчёт sales_hourly с нуля, например после загрузки без триггеров
+        self.query.exec("DELETE FROM sales_hourly")
+        self.query.exec(SALES_REBUILD.format(condition='true'))
+        print('Sales summary rebuilt')
+
+    def _exec_batch(self, sql: str, columns: list) -> int:
+        # один prepare на весь пакет, значения привязываются списками по столбцам
+        if not columns or not columns[0]:
+            return 0
+        query = self._prepare(sql)
+        for column in columns:
+            query.addBindValue(column)
+        if not query.execBatch():
+            raise RuntimeError(query.lastError().text())
+        return len(columns[0])
+
+    def _set_bulk_pragmas(self, enabled: bool) -> None:
+        # на время загрузки отключаем fsync и держим журнал в памяти, потом возвращаем обычные настройки
+        if enabled:
+            self.query.exec("PRAGMA synchronous = OFF")
+            self.query.exec("PRAGMA journal_mode = MEMORY")
+            self.query.exec("PRAGMA cache_size = -65536")
+        else:
+            self._apply_pragmas()
+
+    def _bulk_load(self, products: dict, order_batches, stock: int=100000, bakery_id: int=1) -> None:
+        # products = {name: price}, order_batches - пачки заказов OrderColumns (DF.iter_orders)
+        # триггеры на время загрузки не существуют, поэтому их работу делаем здесь: повторы продукта
+        # в заказе складываются (order_product_insert). Продажи из выгрузки уже прошли, склад ими не списывается:
+        # каждый продукт получает начальный остаток stock
+        started = time.perf_counter()
+
+        product_ids = {}
+        product_columns = ([], [], [])
+        for product_id, (name, price) in enumerate(products.items(), start=1):
+            product_ids[name] = (product_id, price)
+            product_columns[0].append(product_id)
+            product_columns[1].append(name)
+            product_columns[2].append(price)
+
+        self._set_bulk_pragmas(True)
+        self.con.transaction()
+        try:
+            rows = self._exec_batch("INSERT INTO products (id, name, price) VALUES (?, ?, ?)", product_columns)
+            for orders in order_batches:
+                rows += self._load_orders(orders, product_ids, bakery_id)
+            query = self._prepare(
+                """--sql
+                INSERT INTO stock (bakery_id, product_id, quantity)
+                SELECT :bakery_id, id, :stock FROM products
+                """
+            )
+            query.bindValue(":bakery_id", bakery_id)
+            query.bindValue(":stock", stock)
+            if not query.exec():
+                raise RuntimeError(query.lastError().text())
+            rows += query.numRowsAffected()
+            # новое поколение данных: кэши чтений и аналитики во всех соединениях перестают совпадать по версии
+            self._write_setting('data_generation', str(time.time_ns()))
+            self.con.commit()
+        except BaseException as e:
+            # любая ошибка, в том числе в разборе csv или прерывание, откатывает всю загрузку;
+            # без данных остальные шаги пересоздания базы не имеют смысла
+            self.con.rollback()
+            print(f'Bulk load FAILED: {e!r}')
+            raise
+        finally:
+            self._set_bulk_pragmas(False)
+
+        elapsed = time.perf_counter() - started
+        print(f'Loaded {rows} rows in {elapsed:.2f} s ({rows / elapsed:.0f} rows/s)')
+
+    def _load_orders(self, orders: 'OrderColumns', product_ids: dict, bakery_id: int) -> int:
+        # numpy и pandas нужны только загрузчику, поэтому импортируются здесь, а не при старте приложения
+        import numpy as np
+
+        order_columns = (
+            orders.order_id.tolist(),
+            [bakery_id] * len(orders.order_id),
+            orders.date.tolist(),
+            orders.time.tolist(),
+        )
+
+        # коды продуктов пачки -> id и цена по умолчанию из таблицы products
+        ids = np.array([product_ids[name][0] for name in orders.products], dtype=np.int64)
+        default_prices = np.array([product_ids[name][1] for name in orders.products], dtype=float)
+
+        # повторы продукта в заказе: одна строка на (заказ, продукт), количества складываются, цена берётся первая
+        line_order = np.repeat(np.arange(len(orders.order_id)), np.diff(orders.offsets))
+        keys = line_order * len(orders.products) + orders.product
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        quantity = np.bincount(inverse, weights=orders.quantity).astype(np.int64)
+        unit_price = orders.unit_price[first]
+        codes = orders.product[first]
+        price_change = np.where(unit_price == default_prices[codes], None, unit_price.astype(object))
+
+        line_columns = (
+            orders.order_id[line_order[first]].tolist(),
+            ids[codes].tolist(),
+            quantity.tolist(),
+            price_change.tolist(),
+        )
+
+        rows = self._exec_batch("INSERT INTO orders (id, bakery_id, date, time) VALUES (?, ?, ?, ?)", order_columns)
+        rows += self._exec_batch("INSERT INTO order_product (order_id, product_id, quantity, price_change) VALUES (?, ?, ?, ?)", line_columns)
+        return rows
+
+    def _product_ids(self) -> dict:
+        # {название: (id, цена)} всех продуктов
+        query = self._prepare("SELECT id, name, price FROM products")
+        query.exec()
+        products = {}
+        while query.next():
+            products[query.value(1)] = (query.value(0), query.value(2))
+        return products
+
+    def _high_water(self, bakery_id: int) -> tuple:
+        # (id, дата) последнего заказа пекарни, (0, None) для пустой базы
+        query = self._prepare(HOT_QUERIES['import_high_water'])
+        query.bindValue(":bakery_id", bakery_id)
+        query.exec()
+        mark = (query.value(0), query.value(1)) if query.next() else (0, None)
+        query.finish()
+        return mark
+
+    def import_sales(self, path: str, bakery_id: int=1, stock: int=100000) -> int:
+        # дозагрузка выгрузки продаж в формате Bakery_sales.csv: заказы с order_ID не больше последнего
+        # загруженного пропускаются, в памяти остаются только новые строки. Новые продукты добавляются
+        # с самой частой ценой и складом stock; заказы пишутся одной транзакцией, продажи по часам и журнал
+        # обновляют триггеры, поэтому время зависит от размера выгрузки, а не от всей истории
+        import pandas as pd
+        from raw_data.prepare_data import most_popular_prices, order_columns, price_counts, read_csv_chunks
+
+        started = time.perf_counter()
+        shard = self.shard(bakery_id)
+        last_id, last_date = shard._high_water(bakery_id)
+        delta = [chunk[chunk['order_ID'] > last_id] for chunk in read_csv_chunks(path)]
+        data = pd.concat(delta) if delta else None
+        if data is None or data.empty:
+            print(f'Nothing to import: all orders are up to order {last_id} ({last_date})')
+            return 0
+
+        product_ids = self._product_ids()
+        prices = most_popular_prices(price_counts(data))
+        new_products = [(name, price) for name, price in prices.items() if name not in product_ids]
+        orders = order_columns(data)
+
+        self.con.transaction()
+        try:
+            rows = self._exec_batch("INSERT INTO products (name, price) VALUES (?, ?)", tuple(map(list, zip(*new_products))))
+        except RuntimeError as e:
+            self.con.rollback()
+            print(f'Import FAILED: {e}')
+            return 0
+        if shard is not self:
+            # справочник продуктов общий: он фиксируется отдельно и копируется в файл пекарни
+            self.con.commit()
+            self.shards().sync_catalog(shard)
+            shard.con.transaction()
+        product_ids = self._product_ids()
+        # продажи уже состоялись, поэтому проверка остатка в stock_insert их не должна отбрасывать:
+        # на время загрузки триггер снимается, склад списывается одним UPDATE после вставки
+        shard.query.exec("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'stock_insert'")
+        stock_trigger = shard.query.value(0) if shard.query.next() else None
+        shard.query.finish()
+        try:
+            stock_columns = ([bakery_id] * len(new_products), [product_ids[name][0] for name, _ in new_products], [stock] * len(new_products))
+            rows += shard._exec_batch("INSERT INTO stock (bakery_id, product_id, quantity) VALUES (?, ?, ?)", stock_columns)
+            shard.query.exec("DROP TRIGGER IF EXISTS stock_insert")
+            rows += shard._load_orders(orders, product_ids, bakery_id)
+            query = shard._prepare(
+                f"""--sql
+                UPDATE stock SET quantity = quantity - sold.amount, {STOCK_VERSION}
+                FROM (
+                    SELECT product_id, SUM(quantity) AS amount FROM order_product
+                    WHERE order_id IN (SELECT id FROM orders WHERE bakery_id = :bakery_id AND id > :last_id)
+                    GROUP BY product_id
+                ) AS sold
+                WHERE stock.bakery_id = :bakery_id AND stock.product_id = sold.product_id
+                """
+            )
+            query.bindValue(":bakery_id", bakery_id)
+            query.bindValue(":last_id", last_id)
+            if not query.exec():
+                raise RuntimeError(query.lastError().text())
+            if stock_trigger is not None and not shard.query.exec(stock_trigger):
+                raise RuntimeError(shard.query.lastError().text())
+        except RuntimeError as e:
+            shard.con.rollback()
+            print(f'Import FAILED: {e}')
+            return 0
+        shard.con.commit()
+
+        elapsed = time.perf_counter() - started
+        print(f'Imported {len(orders.order_id)} orders after order {last_id} ({last_date}), '
+              f'{len(new_products)} new products: {rows} rows in {elapsed:.2f} s')
+        return rows
+
+    def __insert_data(self, path: str=DATA_PATH) -> None:
         for role in ['admin', 'cashier', 'cook']:
             self.add_role(role)
         print('Roles added')
@@ -414,83 +1369,32 @@ class DBRepo:
         self.add_user(1, 1, 'admin', 'admin', 'admin')
         print('Admin added')
 
+        from raw_data import DF
+
         print('Parsing products...')
-        data = DF()
+        # потоковый режим: файл читается чанками, заказы сразу уходят в загрузчик
+        data = DF(path, chunksize=CHUNK_SIZE)
         products = data.get_products()
-        print('Done. Adding products...')
-        for name, price in products.items():
-            self.add_product(name, price)
-
-        # get all products from db and make a dict {name: (id, price)}
-        self.query.exec("SELECT * FROM products")
-        products = {}
-        while self.query.next():
-            products[self.query.value(1)] = (self.query.value(0), self.query.value(2))
-
-        print('Products added')
-
-        print('Parsing orders...')
-        orders = data.get_orders()
-        print('Done. Foming orders queries...')
-        # orders = {
-        # (150040, '2021-01-02', '08:38'): {'product': ['BAGUETTE', 'PAIN AU CHOCOLAT'],
-        #   'quantity': [1, 3],
-        #   'unit_price': [0.9, 1.2]},
-        # (150041, '2021-01-02', '09:14'): {'product': ['PAIN AU CHOCOLAT', 'PAIN'],
-        #   'quantity': [2, 1],
-        #   'unit_price': [1.2, 1.15]},
-        #  ...}
-
-        query_order = "INSERT INTO orders (bakery_id, date, time, id) VALUES "
-        query_order_list = []
-        query_order_product = "INSERT INTO order_product (order_id, product_id, quantity, price_change) VALUES "
-        query_order_product_list = []
-
-        for (order_id, date, time), order in orders.items():
-            query_order_list.append(f"({1}, '{date}', '{time}', {order_id}),")
-            for product, quantity, unit_price in zip(order['product'], order['quantity'], order['unit_price']):
-                product_id = products[product][0]
-                self.add_stock(product_id, 100000, 1)
-                default_price = products[product][1]
-                if unit_price != default_price:
-                    query_order_product_list.append(f"({order_id}, {product_id}, {quantity}, {unit_price}),")
-                else:
-                    query_order_product_list.append(f"({order_id}, {product_id}, {quantity}, NULL),")
-        print('Orders queries formed')
-
-        # print('Adding orders...')
-        # query_order_list = ''.join(query_order_list)
-        # print('Orders queries joined')
-        # query_order_product_list = ''.join(query_order_product_list)
-        # print('Order_product queries joined')
-        # query_order += query_order_list
-        # query_order_product += query_order_product_list
-        # open('query_order.txt', 'w').write(query_order)
-        # open('query_order_product.txt', 'w').write(query_order_product)
-        # self.query.exec(query_order)
-        # self.query.exec(query_order_product)
-        # print('Orders added')
-        print('Adding orders...')
-        for i in range(0, len(query_order_list), 100):
-            l = query_order_list[i:i+100]
-            l[-1] = l[-1][:-1] + ';'
-            if self.query.exec(query_order + ''.join(l)) == False:
-                print(self.query.lastError().text())
-                break
-            l2 = query_order_product_list[i:i+100]
-            l2[-1] = l2[-1][:-1] + ';'
-            if self.query.exec(query_order_product + ''.join(l2)) == False:
-                print(self.query.lastError().text())
-                print(l2)
-                break
-
-
+        print('Done. Adding products, orders and stock...')
+        self._bulk_load(products, data.iter_orders())
 
     def _reset(self) -> None:
         ans = input('Are you sure you want to reset the database? (y/n) ')
         if ans == 'y':
-            self.drop_tables()
-            self.create_tables()
-            self.add_triggers()
-            self.__insert_data()
-            self._add_log_triggers()
\ No newline at end of file
+            self._reseed()
+
+    def _reseed(self, path: str=DATA_PATH) -> None:
+        # пересоздаёт базу из очищенного csv без подтверждения (им пользуются _reset и бенчмарки).
+        # В режиме sharded данные сначала загружаются в основную БД, а затем переносятся в новые файлы пекарен
+        if self.storage_mode == 'sharded':
+            self.shards().drop()
+        self.drop_tables()
+        self.create_tables()
+        # индексы и триггеры создаются после загрузки, чтобы не обновляться на каждой строке
+        self.__insert_data(path)
+        self.rebuild_sales_summary()
+        self.create_indexes()
+        self.add_triggers()
+        self._add_log_triggers()
+        if self.storage_mode == 'sharded':
+            self.shards().split()
@@ -0,0 +1,175 @@
+import os
+
+from PyQt5.QtSql import QSqlDatabase
+
+from config import SHARD_PATH
+
+
+# таблицы, которые живут в файле пекарни; справочники (пекарни, продукты, пользователи) - в основной БД
+SHARD_TABLES = ('orders', 'order_product', 'stock', 'sales_hourly')
+
+
+class ShardRouter:
+    # заказы, строки заказов и склад каждой пекарни хранятся в отдельном файле со своей копией схемы,
+    # поэтому записи разных пекарен не ждут одну блокировку SQLite. Справочник продуктов копируется
+    # в файлы пекарен: триггеры склада и продаж не могут ссылаться на таблицы другой БД
+    def __init__(self, catalog, path_template: str=SHARD_PATH) -> None:
+        self.catalog = catalog
+        self.path_template = path_template
+        self.repos = {}
+        self.attached = set()
+
+    def path(self, bakery_id: int) -> str:
+        return self.path_template.format(bakery_id)
+
+    def bakery_ids(self) -> list:
+        self.catalog.query.exec("SELECT id FROM bakeries ORDER BY id")
+        ids = []
+        while self.catalog.query.next():
+            ids.append(self.catalog.query.value(0))
+        return ids
+
+    def _open(self, bakery_id: int) -> tuple:
+        # (репозиторий файла пекарни, создан ли файл только что); у нового файла пока нет триггеров
+        from .repository import DBRepo
+
+        path = self.path(bakery_id)
+        created = not os.path.exists(path)
+        con = QSqlDatabase.addDatabase('QSQLITE', f'{self.catalog.con.connectionName()}_shard_{bakery_id}')
+        con.setDatabaseName(path)
+        repo = DBRepo(con, storage_mode='single')
+        if created:
+            repo.create_tables()
+            repo.create_indexes()
+        return repo, created
+
+    def _finish_schema(self, repo) -> None:
+        repo.add_triggers()
+        repo._add_log_triggers(self.catalog.journal_mode)
+
+    def repo_for(self, bakery_id: int):
+        if bakery_id not in self.repos:
+            repo, created = self._open(bakery_id)
+            self.sync_catalog(repo)
+            if created:
+                # новый файл пекарни: её заказы, строки и склад, уже лежащие в основной БД, переносятся в него
+                try:
+                    self._move_rows(repo, bakery_id)
+                except RuntimeError:
+                    self._close(repo)
+                    self._remove_files(bakery_id)
+                    raise
+                self._finish_schema(repo)
+            self.repos[bakery_id] = repo
+        return self.repos[bakery_id]
+
+    def _move_rows(self, repo, bakery_id: int) -> None:
+        # данные копируются до создания триггеров, иначе склад списался бы второй раз
+        repo.query.prepare("ATTACH DATABASE :path AS catalog")
+        repo.query.bindValue(":path", self.catalog.con.databaseName())
+        repo.query.exec()
+        repo.con.transaction()
+        try:
+            for table in SHARD_TABLES:
+                repo.query.prepare(f"INSERT INTO {table} SELECT * FROM catalog.{table} WHERE {self._condition(table, 'catalog.')}")
+                repo.query.bindValue(":bakery_id", bakery_id)
+                if not repo.query.exec():
+                    raise RuntimeError(repo.query.lastError().text())
+        except RuntimeError:
+            repo.con.rollback()
+            repo.query.exec("DETACH DATABASE catalog")
+            raise
+        repo.con.commit()
+        repo.query.exec("DETACH DATABASE catalog")
+
+        # после копирования строки пекарни удаляются из основной БД, иначе там остался бы расходящийся дубль.
+        # Склад удаляется первым, чтобы stock_delete не обновлял его зря, sales_hourly - последней:
+        # триггеры вычитают из неё доли удаляемых строк заказов
+        own_transaction = self.catalog.con.transaction()
+        try:
+            for table in ('stock', 'order_product', 'orders', 'sales_hourly'):
+                query = self.catalog._prepare(f"DELETE FROM {table} WHERE {self._condition(table)}")
+                query.bindValue(":bakery_id", bakery_id)
+                if not query.exec():
+                    raise RuntimeError(query.lastError().text())
+        except RuntimeError:
+            if own_transaction:
+                self.catalog.con.rollback()
+            raise
+        if own_transaction:
+            self.catalog.con.commit()
+
+    @staticmethod
+    def _condition(table: str, schema: str='') -> str:
+        # строки пекарни :bakery_id в таблице из SHARD_TABLES
+        if table == 'order_product':
+            return f"order_id IN (SELECT id FROM {schema}orders WHERE bakery_id = :bakery_id)"
+        return "bakery_id = :bakery_id"
+
+    def sync_catalog(self, repo) -> None:
+        # копия продуктов и пекарен из основной БД в файл пекарни
+        repo.query.prepare("ATTACH DATABASE :path AS catalog")
+        repo.query.bindValue(":path", self.catalog.con.databaseName())
+        repo.query.exec()
+        repo.query.exec(
+            """--sql
+            INSERT INTO products (id, name, price) SELECT id, name, price FROM catalog.products WHERE true
+            ON CONFLICT (id) DO UPDATE SET name = excluded.name, price = excluded.price
+            WHERE name != excluded.name OR price != excluded.price
+            """
+        )
+        repo.query.exec(
+            """--sql
+            INSERT INTO bakeries (id, name, address) SELECT id, name, address FROM catalog.bakeries WHERE true
+            ON CONFLICT (id) DO UPDATE SET name = excluded.name, address = excluded.address
+            WHERE name != excluded.name OR address != excluded.address
+            """
+        )
+        repo.query.exec("DETACH DATABASE catalog")
+
+    def attach(self, bakery_id: int) -> str:
+        # подключает файл пекарни к основному соединению для чтения, возвращает имя схемы
+        schema = f'shard_{bakery_id}'
+        if bakery_id not in self.attached:
+            self.repo_for(bakery_id)
+            self.catalog.query.prepare(f"ATTACH DATABASE :path AS {schema}")
+            self.catalog.query.bindValue(":path", self.path(bakery_id))
+            if not self.catalog.query.exec():
+                raise RuntimeError(self.catalog.query.lastError().text())
+            self.attached.add(bakery_id)
+        return schema
+
+    def detach_all(self) -> None:
+        for bakery_id in self.attached:
+            self.catalog.query.exec(f"DETACH DATABASE shard_{bakery_id}")
+        self.attached.clear()
+
+    def union(self, table: str) -> str:
+        # подзапрос, объединяющий таблицу из файлов всех пекарен
+        parts = [f"SELECT * FROM {self.attach(bakery_id)}.{table}" for bakery_id in self.bakery_ids()]
+        return f"({' UNION ALL '.join(parts)})"
+
+    def split(self) -> None:
+        # переносит заказы, строки и склад из основной БД в файлы всех пекарен сразу, а не при первом
+        # обращении к каждой; уже существующие файлы не трогает
+        for bakery_id in self.bakery_ids():
+            if bakery_id in self.repos or os.path.exists(self.path(bakery_id)):
+                continue
+            self.repo_for(bakery_id)
+            print(f'Bakery {bakery_id} moved to {self.path(bakery_id)}')
+
+    def drop(self) -> None:
+        # закрывает и удаляет файлы пекарен (при пересоздании основной БД их данные устаревают)
+        self.detach_all()
+        for bakery_id in list(self.repos):
+            self._close(self.repos.pop(bakery_id))
+        for bakery_id in self.bakery_ids():
+            self._remove_files(bakery_id)
+
+    def _close(self, repo) -> None:
+        QSqlDatabase.removeDatabase(repo.release())
+
+    def _remove_files(self, bakery_id: int) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path(bakery_id) + suffix):
+                os.remove(self.path(bakery_id) + suffix)
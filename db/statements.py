@@ -0,0 +1,85 @@
+import time
+import weakref
+from collections import OrderedDict
+
+from PyQt5.QtSql import QSqlQuery
+
+
+class Statement(QSqlQuery):
+    # подготовленный запрос, который считает свои выполнения и их время
+    def __init__(self, con, sql: str, stats: dict, cache) -> None:
+        super().__init__(con)
+        self.sql = sql
+        self.stats = stats
+        self.cache = cache
+        # результаты читаются только вперёд: без этого QSqlQuery копит все прочитанные строки у себя
+        self.setForwardOnly(True)
+        # False, если запрос не компилируется (например, таблицы ещё нет)
+        self.prepared = self.prepare(sql)
+
+    def _timed(self, run, *args) -> bool:
+        started = time.perf_counter()
+        ok = run(*args)
+        elapsed = time.perf_counter() - started
+        self.stats['executions'] += 1
+        self.stats['time'] += elapsed
+        if self.cache.profiler is not None:
+            # для SELECT число строк до чтения неизвестно, для записи - число изменённых строк
+            rows = -1 if self.isSelect() else self.numRowsAffected()
+            self.cache.profiler.record_statement(self.cache.repo(), self.sql, elapsed, rows)
+        return ok
+
+    def exec(self, *args) -> bool:
+        return self._timed(super().exec, *args)
+
+    def execBatch(self, *args) -> bool:
+        return self._timed(super().execBatch, *args)
+
+
+class StatementCache:
+    # подготовленные запросы одного соединения: каждый текст SQL компилируется один раз,
+    # дальше тот же запрос выполняется с новыми привязками
+    def __init__(self, con, maxsize: int=128, repo=None) -> None:
+        self.con = con
+        # слабая ссылка: репозиторий владеет кэшем, и цикл не даёт вовремя закрыть соединение
+        self.repo = weakref.ref(repo) if repo is not None else None
+        self.profiler = None
+        self.maxsize = maxsize
+        self.statements = OrderedDict()
+        self.stats = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql: str) -> Statement:
+        statement = self.statements.get(sql)
+        if statement is None:
+            self.misses += 1
+            stats = self.stats.setdefault(sql, {'prepares': 0, 'hits': 0, 'executions': 0, 'time': 0.0})
+            stats['prepares'] += 1
+            statement = Statement(self.con, sql, stats, self)
+            if not statement.prepared:
+                # неудачная подготовка не кэшируется: после создания схемы тот же SQL подготовится заново,
+                # а вызывающий получит ошибку от exec, как с обычным QSqlQuery
+                return statement
+            self.statements[sql] = statement
+            if len(self.statements) > self.maxsize:
+                self.statements.popitem(last=False)
+        elif statement.lastError().isValid():
+            # прошлое выполнение завершилось ошибкой (например, схема изменилась): запрос готовится заново
+            del self.statements[sql]
+            return self.get(sql)
+        else:
+            self.hits += 1
+            statement.stats['hits'] += 1
+            self.statements.move_to_end(sql)
+            # сбрасывает курсор прошлого выполнения, подготовленный запрос остаётся
+            statement.finish()
+        return statement
+
+    def clear(self) -> None:
+        for statement in self.statements.values():
+            statement.finish()
+        self.statements.clear()
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.statements), 'statements': self.stats}
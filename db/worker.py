@@ -0,0 +1,98 @@
+import itertools
+
+from PyQt5.QtCore import QMetaObject, QObject, Qt, QThread, pyqtSignal, pyqtSlot
+
+from .pool import ConnectionPool
+from .profiling import profile_call
+
+
+class DBWorker(QObject):
+    # выполняет методы DBRepo в своём потоке на соединениях пула; пул открывает их в этом же потоке,
+    # потому что QSqlDatabase нельзя использовать из потока, в котором оно не открыто
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+    def __init__(self, latest: dict, pool: ConnectionPool) -> None:
+        super().__init__()
+        self.latest = latest
+        self.pool = pool
+
+    @pyqtSlot()
+    def close(self) -> None:
+        self.pool.release_thread()
+
+    @pyqtSlot(int, str, str, object, bool)
+    def run(self, request_id: int, key: str, method: str, args: tuple, write: bool) -> None:
+        # пока запрос ждал в очереди, по тому же ключу мог прийти более новый - тогда этот не выполняем
+        if self.latest.get(key) != request_id:
+            self.cancelled.emit(request_id)
+            return
+        try:
+            # чтения идут через соединения-читатели и не ждут записи заказов, записи - через единственного писателя
+            with (self.pool.writer() if write else self.pool.reader()) as repo:
+                # при PROFILE_MODE профиль снимается здесь: профилировщик в потоке GUI работу потока не видит
+                result = profile_call(f'DBWorker.{method}', lambda: getattr(repo, method)(*args))
+        except Exception as e:
+            self.failed.emit(request_id, str(e))
+            return
+        self.finished.emit(request_id, result)
+
+
+class AsyncRepo(QObject):
+    # асинхронный доступ к DBRepo для GUI: call() сразу возвращает управление, результат приходит в callback
+    # в потоке GUI. Запросы с одним ключом вытесняют друг друга: отдаётся только результат последнего.
+    # Несколько AsyncRepo с общим пулом работают параллельно, например отчёты рядом с приёмом заказов
+    requested = pyqtSignal(int, str, str, object, bool)
+    error = pyqtSignal(str)
+
+    _ids = itertools.count(1)
+
+    def __init__(self, pool: ConnectionPool=None, parent=None) -> None:
+        super().__init__(parent)
+        self.latest = {}
+        self.callbacks = {}
+        self.thread = QThread()
+        self.worker = DBWorker(self.latest, pool or ConnectionPool())
+        self.worker.moveToThread(self.thread)
+        self.requested.connect(self.worker.run)
+        self.worker.finished.connect(self._on_finished)
+        self.worker.failed.connect(self._on_failed)
+        self.worker.cancelled.connect(self._on_cancelled)
+        self.thread.start()
+
+    def call(self, key: str, method: str, *args, callback=None, write: bool=False) -> int:
+        # write=True - метод меняет данные и выполняется через писателя пула
+        request_id = next(self._ids)
+        self.latest[key] = request_id
+        self.callbacks[request_id] = (key, callback)
+        self.requested.emit(request_id, key, method, args, write)
+        return request_id
+
+    def cancel(self, key: str) -> None:
+        self.latest.pop(key, None)
+
+    def stop(self) -> None:
+        QMetaObject.invokeMethod(self.worker, 'close', Qt.BlockingQueuedConnection)
+        self.thread.quit()
+        self.thread.wait()
+
+    def _take(self, request_id: int):
+        # callback запроса, если он ещё актуален, иначе None
+        key, callback = self.callbacks.pop(request_id, (None, None))
+        if self.latest.get(key) != request_id:
+            return None
+        del self.latest[key]
+        return callback
+
+    def _on_finished(self, request_id: int, result) -> None:
+        callback = self._take(request_id)
+        if callback is not None:
+            callback(result)
+
+    def _on_failed(self, request_id: int, message: str) -> None:
+        if self._take(request_id) is not None:
+            self.error.emit(message)
+
+    def _on_cancelled(self, request_id: int) -> None:
+        self.callbacks.pop(request_id, None)
@@ -1,20 +1,26 @@
-from cProfile import label
-from turtle import right
 from PyQt5.QtSql import QSqlQuery, QSqlDatabase
 from PyQt5.QtWidgets import (QApplication, QWidget,
                              QVBoxLayout, QPushButton,
                              QHBoxLayout, QListWidget, QLineEdit, QTextEdit,
-                             QListWidgetItem, QLabel, QMessageBox, QTableWidget, QTableWidgetItem)
-from PyQt5.QtCore import Qt
+                             QListWidgetItem, QLabel, QMessageBox, QTableWidget, QTableWidgetItem,
+                             QTableView)
+from PyQt5.QtCore import Qt, QTimer
 import sys
 
+from config import STOCK_REFRESH_MS
 from db import DBRepo
-from raw_data import DF
+from db.models import OrdersModel, StockModel
+from db.pool import ConnectionPool
+from db.profiling import profile_action
+from db.worker import AsyncRepo
 
 repo = DBRepo()
-data = DF()
+# журнал изменений чистится при входе в систему, а не при каждом открытии соединения
+repo.prune_logs()
 
 con = repo.get_connection()
+# соединения фоновых потоков окна: читатели не ждут записи заказов
+pool = ConnectionPool()
 
 
 class MainWindow(QWidget):
@@ -24,6 +30,8 @@ class MainWindow(QWidget):
         self.exit_btn = QPushButton('Выход из системы')
         self.export_data_btn = QPushButton('Выгрузка данных')
         self.price = QLabel('0')
+        # запросы к БД из обработчиков идут через фоновый поток, чтобы окно не подвисало
+        self.db = AsyncRepo(pool)
         self.initUI()
         self.bind_events()
         self.get_data()
@@ -52,10 +60,11 @@ class MainWindow(QWidget):
         orders_vbox = QVBoxLayout()
         label = QLabel('Заказы:')
         orders_vbox.addWidget(label)
-        orders_list = QTableWidget()
-        orders_list.setColumnCount(3)
-        orders_list.setRowCount(200000)
-        orders_list.setHorizontalHeaderLabels(['Номер заказа', 'Дата', 'Время'])
+        # заказы подгружаются моделью страницами при прокрутке
+        self.orders_model = OrdersModel(self.db)
+        orders_list = QTableView()
+        orders_list.setModel(self.orders_model)
+        orders_list.setSelectionBehavior(QTableView.SelectRows)
         self.orders_list = orders_list
         orders_vbox.addWidget(orders_list)
         bottom_hbox.addLayout(orders_vbox)
@@ -83,10 +92,10 @@ class MainWindow(QWidget):
         stock_hbox = QVBoxLayout()
         label = QLabel('Наличие:')
         stock_hbox.addWidget(label)
-        stock_table = QTableWidget()
-        stock_table.setColumnCount(3)
-        stock_table.setRowCount(140)
-        stock_table.setHorizontalHeaderLabels(['ID', 'Название', 'Количество'])
+        # остатки обновляются на месте: модель дочитывает только изменившиеся строки
+        self.stock_model = StockModel(self.db)
+        stock_table = QTableView()
+        stock_table.setModel(self.stock_model)
         self.stock_table = stock_table
         stock_hbox.addWidget(self.stock_table)
         bottom_vbox.addLayout(stock_hbox)
@@ -94,51 +103,42 @@ class MainWindow(QWidget):
         self.main_layout.addLayout(bottom_hbox)
 
     def get_data(self):
-        self.orders_list.setRowCount(0)
+        self.orders_model.reload()
         self.order_table.setRowCount(0)
         self.price.setText('0')
-        orders = repo.get_orders()
-        i = 0
-        for order in orders:
-            if order == 150141:
-                break
-            order = orders[order]
-            self.orders_list.insertRow(i)
-            self.orders_list.setItem(i, 0, QTableWidgetItem(str(order["id"])))
-            self.orders_list.setItem(i, 1, QTableWidgetItem(str(order["date"])))
-            self.orders_list.setItem(i, 2, QTableWidgetItem(str(order["time"])))
-            i += 1
-
-        stock = repo.get_stock()
-        i = 0
-        for item in stock:
-            item = stock[item]
-            self.stock_table.insertRow(i)
-            self.stock_table.setItem(i, 0, QTableWidgetItem(str(item["id"])))
-            self.stock_table.setItem(i, 1, QTableWidgetItem(str(item["name"])))
-            self.stock_table.setItem(i, 2, QTableWidgetItem(str(item["quantity"])))
-            i += 1
+
+        self.stock_model.reload()
 
     def get_order(self):
+        # при быстрых кликах показывается только последний выбранный заказ
+        order_id = self.orders_model.order_id(self.orders_list.currentIndex().row())
+        self.db.call('order_detail', 'get_order_detail', order_id, self.orders_model.bakery_id, callback=self.show_order)
+
+    @profile_action()
+    def show_order(self, detail):
         self.order_table.setRowCount(0)
-        order_id = self.orders_list.item(self.orders_list.currentRow(), 0).text()
-        order = repo.get_order(order_id)
-        i = 0
-        for item in order:
-            item = order[item]
+        lines, total = detail
+        for i, (name, quantity, price) in enumerate(lines):
             self.order_table.insertRow(i)
-            self.order_table.setItem(i, 0, QTableWidgetItem(str(item["name"])))
-            self.order_table.setItem(i, 1, QTableWidgetItem(str(item["quantity"])))
-            self.order_table.setItem(i, 2, QTableWidgetItem(str(item["price"])))
-            i += 1
+            self.order_table.setItem(i, 0, QTableWidgetItem(str(name)))
+            self.order_table.setItem(i, 1, QTableWidgetItem(str(quantity)))
+            self.order_table.setItem(i, 2, QTableWidgetItem(str(price)))
         # self.order_table.resizeColumnsToContents()
-        self.price.setText(str(repo.get_order_price(order_id)))
+        self.price.setText(str(total))
 
     def bind_events(self):
         # self.new_order_btn.clicked.connect(self.new_order)
         # self.exit_btn.clicked.connect(self.exit)
         # self.get_data_btn.clicked.connect(self.get_data)
-        self.orders_list.itemClicked.connect(self.get_order)
+        self.orders_list.clicked.connect(self.get_order)
+        self.stock_timer = QTimer(self)
+        self.stock_timer.timeout.connect(self.stock_model.refresh)
+        self.stock_timer.start(STOCK_REFRESH_MS)
+
+    def closeEvent(self, event):
+        self.stock_timer.stop()
+        self.db.stop()
+        super().closeEvent(event)
 
 
 
@@ -1 +1 @@
-from .prepare_data import clear_data, DF
\ No newline at end of file
+from .prepare_data import clear_data, DF, OrderColumns
\ No newline at end of file
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # без pyarrow кэш не используется, данные читаются из csv
+    pa = None
+
+
+# схема кэша: названия продуктов хранятся словарём, а не строкой в каждой строке
+SCHEMA = None if pa is None else pa.schema([
+    ('date', pa.string()),
+    ('time', pa.string()),
+    ('order_ID', pa.int32()),
+    ('product', pa.dictionary(pa.int32(), pa.string())),
+    ('quantity', pa.int32()),
+    ('unit_price', pa.float32()),
+])
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def paths(source: str) -> tuple:
+    # кэш лежит рядом с исходным csv: Bakery_sales.feather и Bakery_sales.meta.json
+    base = os.path.splitext(source)[0]
+    return base + '.feather', base + '.meta.json'
+
+
+def file_hash(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _write_meta(meta_path: str, meta: dict) -> None:
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def is_fresh(source: str) -> bool:
+    # кэш годен, если совпадают размер и mtime исходного файла, а при другом mtime - его хэш
+    if pa is None:
+        return False
+    data_path, meta_path = paths(source)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        stat = os.stat(source)
+    except (OSError, ValueError):
+        return False
+    if not os.path.exists(data_path) or meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] == stat.st_mtime_ns:
+        return True
+    # файл трогали, но содержимое могло остаться прежним - тогда только обновляем отметку времени
+    if meta['sha1'] == file_hash(source):
+        meta['mtime'] = stat.st_mtime_ns
+        _write_meta(meta_path, meta)
+        return True
+    return False
+
+
+def version(source: str) -> str:
+    # версия набора данных - хэш исходного файла, записанный при построении кэша
+    if is_fresh(source):
+        with open(paths(source)[1]) as f:
+            return json.load(f)['sha1']
+    return file_hash(source)
+
+
+def write(source: str, frames, chunksize: int) -> None:
+    # frames - очищенные чанки; в файле каждая пачка записей - не больше chunksize строк
+    data_path, meta_path = paths(source)
+    stat = os.stat(source)
+    tables = []
+    for frame in frames:
+        frame = frame.assign(product=frame['product'].astype(str))
+        tables.append(pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False))
+    table = pa.concat_tables(tables).unify_dictionaries() if tables else SCHEMA.empty_table()
+    # без сжатия, чтобы файл можно было читать через memory map без копирования
+    feather.write_feather(table, data_path + '.tmp', compression='uncompressed', chunksize=chunksize)
+    os.replace(data_path + '.tmp', data_path)
+    _write_meta(meta_path, {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': file_hash(source)})
+
+
+def load(source: str, columns: list=None):
+    table = feather.read_table(paths(source)[0], columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def iter_batches(source: str):
+    reader = pa.ipc.open_file(pa.memory_map(paths(source)[0]))
+    for i in range(reader.num_record_batches):
+        yield reader.get_batch(i).to_pandas()
@@ -1,39 +1,179 @@
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
 
+from config import CHUNK_SIZE, DATA_PATH, RAW_DATA_PATH
 
-def clear_data():
-    # считываем данные из файла
-    data = pd.read_csv("./raw_data/Bakery sales.csv.bak", index_col=0)
+from . import cache
 
-    # задаём названия столбцов
-    data.columns = ["date", "time", "order_ID", "product", "quantity", "unit_price"]
 
-    # переводим колонку transaction_ID в целочисленный тип
-    data.order_ID = data.order_ID.astype(int)
+# типы столбцов очищенного файла: для потокового чтения задаём их явно, чтобы pandas не угадывал по каждому чанку
+DTYPES = {
+    "date": "object",
+    "time": "object",
+    "order_ID": "int32",
+    "product": "category",
+    "quantity": "int32",
+    "unit_price": "float32",
+}
 
-    # переводим колонку quantity в целочисленный тип
-    data.quantity = data.quantity.astype(int)
 
-    # переводим колонку unit_price в вещественный тип, заменяем , на . и убираем €
-    data.unit_price = data.unit_price.str.replace(" €", "").str.replace(",", ".").astype(float)
+def clear_data(chunksize=CHUNK_SIZE):
+    # считываем данные из файла по частям, чтобы не держать весь файл в памяти
+    chunks = pd.read_csv(RAW_DATA_PATH, index_col=0, chunksize=chunksize)
+    for i, data in enumerate(chunks):
+        # задаём названия столбцов
+        data.columns = ["date", "time", "order_ID", "product", "quantity", "unit_price"]
 
-    # сохраняем изменённые данные в файл
-    data.to_csv("./raw_data/Bakery_sales.csv", index=False)
+        # переводим колонку transaction_ID в целочисленный тип
+        data.order_ID = data.order_ID.astype(int)
 
+        # переводим колонку quantity в целочисленный тип
+        data.quantity = data.quantity.astype(int)
 
+        # переводим колонку unit_price в вещественный тип, заменяем , на . и убираем €
+        data.unit_price = data.unit_price.str.replace(" €", "").str.replace(",", ".").astype(float)
 
-class DF:
-    def __init__(self):
-        data = pd.read_csv("./raw_data/Bakery_sales.csv")
-        data.drop(data[data['unit_price'] == 0].index, inplace=True)
-        data.drop(data[data['product'].str.contains("DIVERS")].index, inplace=True)
-        data.drop(data[data['product'] == "TRAITEUR"].index, inplace=True)
-        self.data = data
+        # дописываем изменённые данные в файл, заголовок только в первом чанке
+        data.to_csv(DATA_PATH, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+    # сразу строим колоночный кэш, чтобы DF не разбирал csv при первом запуске
+    if cache.available():
+        build_cache(DATA_PATH, chunksize)
+
+
+def filter_data(data):
+    # убираем позиции с нулевой ценой, DIVERS и TRAITEUR
+    mask = (data['unit_price'] != 0) & ~data['product'].str.contains("DIVERS") & (data['product'] != "TRAITEUR")
+    return data[mask]
+
+
+def read_csv_chunks(path=DATA_PATH, chunksize=CHUNK_SIZE):
+    for chunk in pd.read_csv(path, dtype=DTYPES, chunksize=chunksize):
+        yield filter_data(chunk)
+
+
+def build_cache(path=DATA_PATH, chunksize=CHUNK_SIZE):
+    cache.write(path, read_csv_chunks(path, chunksize), chunksize)
+
+
+def use_cache(path=DATA_PATH):
+    # True, если очищенные данные можно читать из колоночного кэша (при необходимости он перестраивается)
+    if not cache.available():
+        return False
+    if not cache.is_fresh(path):
+        build_cache(path)
+    return True
+
+
+def read_chunks(path=DATA_PATH, chunksize=CHUNK_SIZE):
+    # из кэша чанки читаются пачками того размера, с которым кэш был записан
+    if use_cache(path):
+        yield from cache.iter_batches(path)
+    else:
+        yield from read_csv_chunks(path, chunksize)
 
 
+class OrderColumns(NamedTuple):
+    # заказы в плоском виде: строки заказа i лежат в product/quantity/unit_price[offsets[i]:offsets[i + 1]]
+    order_id: np.ndarray
+    date: np.ndarray
+    time: np.ndarray
+    offsets: np.ndarray
+    product: np.ndarray  # коды продуктов, название - products[code]
+    quantity: np.ndarray
+    unit_price: np.ndarray
+    products: list
+
+    def to_dict(self):
+        # прежний формат get_orders: {(order_id, date, time): {'product': [...], 'quantity': [...], 'unit_price': [...]}}
+        orders = {}
+        for i, key in enumerate(zip(self.order_id.tolist(), self.date.tolist(), self.time.tolist())):
+            lines = slice(self.offsets[i], self.offsets[i + 1])
+            orders[key] = {
+                'product': [self.products[code] for code in self.product[lines]],
+                'quantity': self.quantity[lines].tolist(),
+                'unit_price': self.unit_price[lines].tolist(),
+            }
+        return orders
+
+
+def order_columns(data):
+    # строки одного заказа идут подряд, поэтому границы заказов - места смены order_ID
+    data = data.sort_values('order_ID', kind='stable')
+    order_id = data['order_ID'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, order_id[1:] != order_id[:-1]])
+    product = data['product'].astype(str).astype('category')
+    return OrderColumns(
+        order_id=order_id[starts],
+        date=data['date'].to_numpy()[starts],
+        time=data['time'].to_numpy()[starts],
+        offsets=np.append(starts, len(order_id)),
+        product=product.cat.codes.to_numpy(),
+        quantity=data['quantity'].to_numpy(),
+        # float32 -> округлённый float64, иначе 1.2 не совпадёт с ценой из get_products
+        unit_price=data['unit_price'].to_numpy(dtype=float).round(2),
+        products=list(product.cat.categories),
+    )
+
+
+def price_counts(data):
+    return data.assign(product=data['product'].astype(str)).value_counts(['product', 'unit_price'], sort=False)
+
+
+def most_popular_prices(counts):
+    # самая частая цена продукта - первая пара (продукт, цена) после сортировки по убыванию счётчика
+    counts = counts.sort_values(ascending=False, kind='stable').reset_index()
+    return counts.drop_duplicates('product').set_index('product')['unit_price'].astype(float).round(2)
+
+
+class DF:
+    def __init__(self, path=DATA_PATH, chunksize=None, columns=None):
+        # chunksize=None - весь файл в памяти, иначе потоковый режим: файл читается по chunksize строк;
+        # columns - загрузить только эти столбцы
+        self.path = path
+        self.chunksize = chunksize
+        self.data = None
+        if chunksize is None:
+            if use_cache(path):
+                self.data = cache.load(path, columns)
+            else:
+                data = filter_data(pd.read_csv(path))
+                self.data = data if columns is None else data[columns]
+
     def get_products(self):
-        most_popular_prices = self.data.groupby('product')['unit_price'].agg(lambda x: x.value_counts().index[0])
-        return most_popular_prices.to_dict()
+        if self.data is None:
+            # считаем пары (продукт, цена) по чанкам и складываем счётчики
+            counts = None
+            for chunk in read_chunks(self.path, self.chunksize):
+                chunk_counts = price_counts(chunk)
+                counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+        else:
+            counts = price_counts(self.data)
+        return most_popular_prices(counts).to_dict()
 
     def get_orders(self):
-        return self.data.groupby(['order_ID', 'date', 'time'])['product', 'quantity', 'unit_price'].apply(lambda x: x.to_dict(orient='list')).to_dict()
\ No newline at end of file
+        if self.data is None:
+            # в потоковом режиме собираем отфильтрованные чанки в один кадр
+            return order_columns(pd.concat(read_chunks(self.path, self.chunksize)))
+        return order_columns(self.data)
+
+    def iter_orders(self):
+        # отдаёт заказы пачками OrderColumns; в потоковом режиме пачка - один чанк
+        if self.data is not None:
+            yield self.get_orders()
+            return
+        # заказ может оказаться разрезан границей чанка: его хвост переносим в следующий чанк
+        tail = None
+        for chunk in read_chunks(self.path, self.chunksize):
+            if tail is not None:
+                chunk = pd.concat([tail, chunk])
+            if chunk.empty:
+                continue
+            is_tail = chunk['order_ID'] == chunk['order_ID'].iloc[-1]
+            tail = chunk[is_tail]
+            if not is_tail.all():
+                yield order_columns(chunk[~is_tail])
+        if tail is not None and not tail.empty:
+            yield order_columns(tail)